@@ -14,61 +14,167 @@
 #  DB 12   ; a decimal byte
 #  DB 0b0001 ; a binary byte
 
+import io
+import os
 import sys
 import re
+import json
+
+# Binary images are written by the emulator's own image module, so the two
+# can't disagree about the format
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ls8"))
+import image
 
 # Opcodes
 OPCODES = {
-    "ADD":  {"type": 2, "code": "10100000"},
-    "AND":  {"type": 2, "code": "10101000"},
-    "CALL": {"type": 1, "code": "01010000"},
-    "CMP":  {"type": 2, "code": "10100111"},
-    "DEC":  {"type": 1, "code": "01100110"},
-    "DIV":  {"type": 2, "code": "10100011"},
-    "HLT":  {"type": 0, "code": "00000001"},
-    "INC":  {"type": 1, "code": "01100101"},
-    "INT":  {"type": 1, "code": "01010010"},
-    "IRET": {"type": 0, "code": "00010011"},
-    "JEQ":  {"type": 1, "code": "01010101"},
-    "JGE":  {"type": 1, "code": "01011010"},
-    "JGT":  {"type": 1, "code": "01010111"},
-    "JLE":  {"type": 1, "code": "01011001"},
-    "JLT":  {"type": 1, "code": "01011000"},
-    "JMP":  {"type": 1, "code": "01010100"},
-    "JNE":  {"type": 1, "code": "01010110"},
-    "LD":   {"type": 2, "code": "10000011"},
-    "LDI":  {"type": 8, "code": "10000010"},
-    "MOD":  {"type": 2, "code": "10100100"},
-    "MUL":  {"type": 2, "code": "10100010"},
-    "NOP":  {"type": 0, "code": "00000000"},
-    "NOT":  {"type": 1, "code": "01101001"},
-    "OR":   {"type": 2, "code": "10101010"},
-    "POP":  {"type": 1, "code": "01000110"},
-    "PRA":  {"type": 1, "code": "01001000"},
-    "PRN":  {"type": 1, "code": "01000111"},
-    "PUSH": {"type": 1, "code": "01000101"},
-    "RET":  {"type": 0, "code": "00010001"},
-    "SHL":  {"type": 2, "code": "10101100"},
-    "SHR":  {"type": 2, "code": "10101101"},
-    "ST":   {"type": 2, "code": "10000100"},
-    "SUB":  {"type": 2, "code": "10100001"},
-    "XOR":  {"type": 2, "code": "10101011"},
+    "ADD":  {"type": 2, "code": 0b10100000},
+    "AND":  {"type": 2, "code": 0b10101000},
+    "CALL": {"type": 1, "code": 0b01010000},
+    "CMP":  {"type": 2, "code": 0b10100111},
+    "DEC":  {"type": 1, "code": 0b01100110},
+    "DIV":  {"type": 2, "code": 0b10100011},
+    "HLT":  {"type": 0, "code": 0b00000001},
+    "INC":  {"type": 1, "code": 0b01100101},
+    "INT":  {"type": 1, "code": 0b01010010},
+    "IRET": {"type": 0, "code": 0b00010011},
+    "JEQ":  {"type": 1, "code": 0b01010101},
+    "JGE":  {"type": 1, "code": 0b01011010},
+    "JGT":  {"type": 1, "code": 0b01010111},
+    "JLE":  {"type": 1, "code": 0b01011001},
+    "JLT":  {"type": 1, "code": 0b01011000},
+    "JMP":  {"type": 1, "code": 0b01010100},
+    "JNE":  {"type": 1, "code": 0b01010110},
+    "LD":   {"type": 2, "code": 0b10000011},
+    "LDI":  {"type": 8, "code": 0b10000010},
+    "MOD":  {"type": 2, "code": 0b10100100},
+    "MUL":  {"type": 2, "code": 0b10100010},
+    "NOP":  {"type": 0, "code": 0b00000000},
+    "NOT":  {"type": 1, "code": 0b01101001},
+    "OR":   {"type": 2, "code": 0b10101010},
+    "POP":  {"type": 1, "code": 0b01000110},
+    "PRA":  {"type": 1, "code": 0b01001000},
+    "PRN":  {"type": 1, "code": 0b01000111},
+    "PUSH": {"type": 1, "code": 0b01000101},
+    "RET":  {"type": 0, "code": 0b00010001},
+    "SHL":  {"type": 2, "code": 0b10101100},
+    "SHR":  {"type": 2, "code": 0b10101101},
+    "ST":   {"type": 2, "code": 0b10000100},
+    "SUB":  {"type": 2, "code": 0b10100001},
+    "XOR":  {"type": 2, "code": 0b10101011},
 }
 
 # Regex for matching lines
 # Capturing groups: label, opcode, operandA, operandB
-REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
+LINE = re.compile(r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?")
 
 # Regex for capturing DS and DB data
-REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
-REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
+DS = re.compile(r"(?:(\w+?):)?\s*DS\s*(.+)", re.IGNORECASE)
+DB = re.compile(r"(?:(\w+?):)?\s*DB\s*(.+)", re.IGNORECASE)
+
+# Register names
+REGISTERS = {f"R{i}": i for i in range(8)}
+
+
+class AssemblyError(Exception):
+    """
+    An error in the source. status is the exit status the command line
+    reports it with.
+    """
+
+    def __init__(self, message, status=2):
+        super().__init__(message)
+        self.status = status
+
+
+class Program:
+    """
+    Machine code from pass1, with its symbol table.
+    """
+
+    def __init__(self):
+        self.code = bytearray()
+        self.symbols = {}
+
+        # (offset, symbol, line number) for each operand naming a label
+        # that wasn't defined yet, to be patched by resolve()
+        self.fixups = []
+
+        # (address, label) in source order
+        self.labels = []
+
+        # Offset -> comment for the .ls8 text listing, or None if the
+        # listing wasn't asked for
+        self.comments = None
+
+        # (start, end, line number) for each statement, for debug_map()
+        self.lines = []
+
+
+class Statement:
+    """
+    One source line with an opcode, and the labels in front of it.
+    """
+
+    __slots__ = ("labels", "opcode", "line_num", "a", "b", "text", "data")
+
+    def __init__(self, labels, opcode, line_num):
+        self.labels = labels
+        self.opcode = opcode
+        self.line_num = line_num
+
+        # Register numbers, or for LDI the value or symbol name
+        self.a = None
+        self.b = None
+
+        # Comment for the .ls8 listing (for DS, the string itself)
+        self.text = None
+
+        # Bytes for DS and DB
+        self.data = None
+
+    def reads(self, reg):
+        """True if this statement reads register reg."""
+
+        opcode = self.opcode
+
+        if opcode is None or self.data is not None or opcode in BARRIERS:
+            return True
+
+        if reg == SP and opcode in STACK:
+            return True
+
+        if opcode == "LDI" or opcode == "POP":
+            return False
+
+        if opcode == "LD":
+            return reg == self.b
+
+        return reg == self.a or reg == self.b
+
+    def writes(self, reg):
+        """True if this statement sets register reg."""
+
+        opcode = self.opcode
+
+        if reg == SP and opcode in STACK:
+            return True
+
+        return opcode in WRITES_A and reg == self.a
 
 
 def parse_commandline(argv):
     """
-    Usage: asm.py [inputfile] [outputfile]
+    Usage: asm.py [-O] [-g] [inputfile] [outputfile]
+
+    An outputfile ending in .ls8b gets a binary image instead of text. -O
+    runs the peephole optimizer. -g writes a debug map: into the image, or
+    next to a text outputfile as outputfile.map.
     """
 
+    optimize = "-O" in argv[1:]
+    debug = "-g" in argv[1:]
+    argv = [a for a in argv if a not in ("-O", "-g")]
+
     if len(argv) == 1:
         inputfile = "-"
         outputfile = "-"
@@ -82,10 +188,14 @@ def parse_commandline(argv):
         outputfile = argv[2]
 
     else:
-        print("usage: asm.py [infile.asm] [outfile.ls8]", file=sys.stderr)
+        print("usage: asm.py [-O] [-g] [infile.asm] [outfile.ls8]", file=sys.stderr)
         sys.exit(1)
 
-    return inputfile, outputfile
+    if debug and outputfile == "-":
+        print("asm.py: -g needs an output file", file=sys.stderr)
+        sys.exit(1)
+
+    return inputfile, outputfile, optimize, debug
 
 
 def open_files(inputfile, outputfile):
@@ -101,302 +211,691 @@ def open_files(inputfile, outputfile):
 
     if outputfile == "-":
         outputfile = sys.stdout
+    elif is_binary_output(outputfile):
+        outputfile = open(outputfile, "wb")
     else:
         outputfile = open(outputfile, "w")
 
     return inputfile, outputfile
 
 
-def normalize_line(groups):
+def is_binary_output(outputfile):
     """
-    Takes match groups and uppercases them if they're not None.
+    True if outputfile names a binary image.
     """
 
-    result = []
-
-    for g in groups:
-        if g is None:
-            result.append(None)
-        else:
-            result.append(g.upper())
+    return isinstance(outputfile, str) and outputfile.endswith(".ls8b")
 
-    return result
 
+def assemble(source, optimize=False):
+    """
+    Assemble source (a string, or an iterable of lines such as a file) and
+    return the machine code. With optimize, the peephole optimizer runs
+    first. Raises AssemblyError for bad source.
+    """
 
-def p8(v):
-    return "{:08b}".format(v)
+    program = pass1(source, optimize=optimize)
+    resolve(program)
+    return bytes(program.code)
 
 
-def pass1(inputfile, sym, code):
+def pass1(source, listing=False, optimize=False):
     """
     Pass 1
 
     * Read the source code lines
     * Parse labels, opcodes, and operands
+    * Optionally run the peephole optimizer over them
     * Record label offsets
-    * Emit machine code
+    * Emit machine code, leaving a fixup for each forward reference
+
+    With listing, also keep the comments for the .ls8 text output.
     """
 
-    # Source line number
-    line_num = 0
+    statements = parse(source)
+
+    if optimize:
+        statements = peephole(statements)
+
+    return emit(statements, listing)
 
-    # Current code address (for labels)
-    addr = 0
 
-    def get_reg(op, fatal=True):
+def parse(source):
+    """
+    Parse source into a list of Statements, checking opcodes, operand
+    counts and registers.
+    """
+
+    if isinstance(source, str):
+        source = source.splitlines()
+
+    statements = []
+    defined = set()
+
+    # Labels waiting for the next statement
+    labels = []
+
+    line_num = 0
+
+    def get_reg(op):
         """Get a register number from a string, e.g. "R2" -> 2"""
 
-        nonlocal line_num
+        reg = REGISTERS.get(op)
 
-        m = re.match(r"R([0-7])", op)
+        if reg is None:
+            raise AssemblyError(f"Line {line_num}: unknown register {op}", 1)
 
-        if m is None:
-            if fatal:
-                print(f"Line {line_num}: unknown register {op}",
-                      file=sys.stderr)
-                sys.exit(1)
-            else:
-                return None
+        return reg
 
-        return int(m.group(1))
+    def check_ops(opcode, desired, found):
+        """Makes sure we have the right operand count"""
 
-    def out0(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with zero operands"""
+        if found < desired:
+            raise AssemblyError(f"Line {line_num}: missing operand to {opcode}", 1)
+        elif found > desired:
+            raise AssemblyError(f"Line {line_num}: unexpected operand to {opcode}", 1)
 
-        nonlocal addr
+    for line in source:
+        line_num += 1
 
-        code.append(f"{machine_code} # {opcode}")
-        addr += 1
+        # Strip comments
+        comment_index = line.find(';')
+        if comment_index != -1:
+            line = line[:comment_index]
 
-    def out1(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with one operand"""
+        # Normalize
+        line = line.strip()
 
-        nonlocal addr
+        # Ignore blank lines
+        if line == '':
+            continue
 
-        reg_a = get_reg(op_a)
-        code.append(f"{machine_code} # {opcode} {op_a}")
-        code.append(p8(reg_a))
-        addr += 2
+        label, opcode, op_a, op_b = LINE.match(line).groups()
 
-    def out2(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with two operands"""
+        if label is not None:
+            label = label.upper()
 
-        nonlocal addr
+            if label in defined:
+                raise AssemblyError(f"line {line_num}: duplicate label {label}")
 
-        reg_a = get_reg(op_a)
-        reg_b = get_reg(op_b)
+            defined.add(label)
+            labels.append(label)
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(p8(reg_b))
+        if opcode is None:
+            continue
 
-        addr += 3
+        opcode = opcode.upper()
+        st = Statement(labels, opcode, line_num)
+        labels = []
+        statements.append(st)
 
-    def out8(opcode, op_a, op_b, machine_code):
-        """Handle LDI opcode (type 8)"""
+        if opcode == 'DS':
+            m = DS.match(line)
 
-        nonlocal addr
+            if m is None:
+                raise AssemblyError(f"line {line_num}: missing argument to DS")
 
-        reg_a = get_reg(op_a)
+            st.text = m.group(2)
 
-        try:
-            val_b = int(op_b, 0)
-            out_b = p8(val_b)
+            try:
+                st.data = st.text.encode("latin-1")
 
-        except ValueError:
-            # If it's not a value, it might be a symbol
-            out_b = f"sym:{op_b}"
+            except UnicodeEncodeError:
+                raise AssemblyError(f"line {line_num}: DS character doesn't fit in a byte")
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(out_b)
+            continue
 
-        addr += 3
+        if opcode == 'DB':
+            m = DB.match(line)
 
-    def handle_ds(line):
-        """
-        Handle DS pseudo-opcode
-        """
+            if m is None:
+                raise AssemblyError(f"line {line_num}: missing argument to DB")
 
-        nonlocal addr
+            st.text = m.group(2)
 
-        m = re.match(REGEX_DS, line, re.IGNORECASE)
+            try:
+                val = int(st.text, 0)
 
-        if m is None or m.group(2) is None:
-            print(f"line {line_num}: missing argument to DS", file=sys.stderr)
-            sys.exit(2)
+            except ValueError:
+                raise AssemblyError(f"line {line_num}: invalid integer argument to DB")
 
-        data = m.group(2)
+            # Force to byte size
+            st.data = bytes((val & 0xff,))
 
-        for i in range(len(data)):
-            print_char = data[i]
+            continue
 
-            if print_char == ' ':
-                print_char = '[space]'
+        op_info = OPCODES.get(opcode)
 
-            code.append(f"{p8(ord(data[i]))} # {print_char}")
+        # Make sure we know this opcode at all
+        if op_info is None:
+            raise AssemblyError(f"line {line_num}: unknown opcode {opcode}")
+
+        op_type = op_info["type"]
+        total_operands = (op_a is not None) + (op_b is not None)
+
+        if op_type == 0:
+            check_ops(opcode, 0, total_operands)
+            st.text = opcode
+
+        elif op_type == 1:
+            check_ops(opcode, 1, total_operands)
+            op_a = op_a.upper()
+            st.a = get_reg(op_a)
+            st.text = f"{opcode} {op_a}"
+
+        elif op_type == 2:
+            check_ops(opcode, 2, total_operands)
+            op_a = op_a.upper()
+            op_b = op_b.upper()
+            st.a = get_reg(op_a)
+            st.b = get_reg(op_b)
+            st.text = f"{opcode} {op_a},{op_b}"
 
-        addr += len(data)
+        else:
+            # LDI r,i or LDI r,label
+            check_ops(opcode, 2, total_operands)
+            op_a = op_a.upper()
+            op_b = op_b.upper()
+            st.a = get_reg(op_a)
 
-    def handle_db(line):
-        """
-        Handle the DB pseudo-opcode
-        """
+            try:
+                st.b = int(op_b, 0) & 0xff
 
-        nonlocal addr
+            except ValueError:
+                # If it's not a value, it's a symbol
+                st.b = op_b
 
-        m = re.match(REGEX_DB, line, re.IGNORECASE)
+            st.text = f"{opcode} {op_a},{op_b}"
 
-        if m is None or m.group(2) is None:
-            print(f"line {line}: missing argument to DB", file=sys.stderr)
-            sys.exit(2)
+    if labels:
+        # Labels after the last statement
+        statements.append(Statement(labels, None, line_num))
 
-        data = m.group(2)
+    return statements
 
-        try:
-            val = int(data, 0)
 
-        except ValueError:
-            print(f"line {line_num}: invalid integer argument to DB",
-                  file=sys.stderr)
-            sys.exit(2)
+def emit(statements, listing=False):
+    """
+    Emit the machine code for statements into a Program. An LDI naming a
+    label that isn't defined yet leaves a fixup for resolve().
+    """
 
-        # Force to byte size
-        val &= 0xff
+    program = Program()
+    code = program.code
+    sym = program.symbols
+    fixups = program.fixups
+    labels = program.labels
+    lines = program.lines
+    comments = program.comments = {} if listing else None
 
-        code.append(f"{p8(val)} # {data}")
+    for st in statements:
+        addr = len(code)
 
-        addr += 1
+        # Track label addresses
+        for label in st.labels:
+            sym[label] = addr
+            labels.append((addr, label))
 
-    def check_ops(opcode, op_a, op_b):
-        """Check operands for sanity with a particular opcode"""
+        opcode = st.opcode
 
-        def check_ops_count(desired, found):
-            # Makes sure we have right operand count
-            if found < desired:
-                print(f"Line {line_num}: missing operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
-            elif found > desired:
-                print(f"Line {line_num}: unexpected operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
+        if opcode is None:
+            continue
 
-        # Make sure we know this opcode at all
-        if opcode not in OPCODES:
-            print(f"line {line_num}: unknown opcode {opcode}", file=sys.stderr)
-            sys.exit(2)
+        if st.data is not None:
+            code += st.data
+            lines.append((addr, len(code), st.line_num))
 
-        op_type = OPCODES[opcode]["type"]
+            if comments is not None:
+                if opcode == 'DS':
+                    for i, char in enumerate(st.text):
+                        comments[addr + i] = '[space]' if char == ' ' else char
+                else:
+                    comments[addr] = st.text
 
-        total_operands = 0
+            continue
 
-        if op_a is not None:
-            total_operands += 1
+        op_info = OPCODES[opcode]
+        op_type = op_info["type"]
 
-        if op_b is not None:
-            total_operands += 1
+        if op_type == 0:
+            code.append(op_info["code"])
 
-        if op_type == 0 or op_type == 1 or op_type == 2:
-            # 0, 1, or 2 register operands
-            check_ops_count(op_type, total_operands)
+        elif op_type == 1:
+            code += bytes((op_info["code"], st.a))
 
-        elif op_type == 8:
-            # LDI r,i or LDI r,label
-            check_ops_count(2, total_operands)
-
-    # Type to function mapping
-    type_f = {
-        0: out0,
-        1: out1,
-        2: out2,
-        8: out8,
-    }
+        elif op_type == 2:
+            code += bytes((op_info["code"], st.a, st.b))
 
-    for line in inputfile:
-        line_num += 1
+        else:
+            val_b = st.b
 
-        # Strip comments
-        comment_index = line.find(';')
-        if comment_index != -1:
-            line = line[:comment_index]
+            if isinstance(val_b, str):
+                # A symbol: one that isn't defined yet gets filled in by
+                # resolve()
+                name = val_b
+                val_b = sym.get(name)
 
-        # Normalize
-        line = line.strip()
+                if val_b is None:
+                    fixups.append((addr + 2, name, st.line_num))
+                    val_b = 0
 
-        # Ignore blank lines
-        if input == '':
+            code += bytes((op_info["code"], st.a, val_b))
+
+        lines.append((addr, len(code), st.line_num))
+
+        if comments is not None:
+            comments[addr] = st.text
+
+    return program
+
+
+# Peephole optimizer
+#
+# It works on the statement list, before any addresses are assigned, so
+# labels stay correct however much code it removes: a label on a removed
+# statement moves to the one after it. It assumes what LS-8 programs here
+# do, that code is only ever reached through labels (jump targets loaded
+# with LDI), never through numeric addresses or by computing an address.
+
+# Instructions that never fall through to the next one
+NO_FALL_THROUGH = {"JMP", "RET", "HLT", "IRET"}
+
+# Instructions that jump through the register they name
+JUMPS = {"CALL", "JMP", "JEQ", "JNE", "JGT", "JLT", "JGE", "JLE"}
+
+# Instructions whose effects on registers aren't known here: after a CALL
+# or INT any register may have changed, and jumps, returns and halts leave
+# every register for someone else to read
+BARRIERS = JUMPS | NO_FALL_THROUGH | {"INT"}
+
+# Instructions that change the stack pointer, R7
+SP = 7
+STACK = {"PUSH", "POP", "CALL", "RET", "INT", "IRET"}
+
+# IM, IS and SP: writing them has effects of its own (an interrupt can be
+# taken between two writes to IM), so their values aren't followed and
+# loads into them are never removed
+SPECIAL_REGISTERS = {5, 6, SP}
+
+# Instructions that write their first register
+WRITES_A = {"ADD", "AND", "DEC", "DIV", "INC", "LD", "LDI", "MOD", "MUL",
+            "NOT", "OR", "POP", "SHL", "SHR", "SUB", "XOR"}
+
+# Results of two-register ALU instructions, for folding known values
+FOLD = {
+    "ADD": lambda a, b: a + b,
+    "SUB": lambda a, b: a - b,
+    "MUL": lambda a, b: a * b,
+    "DIV": lambda a, b: a // b if b else None,
+    "MOD": lambda a, b: a % b if b else None,
+    "AND": lambda a, b: a & b,
+    "OR":  lambda a, b: a | b,
+    "XOR": lambda a, b: a ^ b,
+    "SHL": lambda a, b: a << b,
+    "SHR": lambda a, b: a >> b,
+}
+
+# Second operand values that leave the first register unchanged
+IDENTITY = {
+    "ADD": 0, "SUB": 0, "OR": 0, "XOR": 0, "SHL": 0, "SHR": 0,
+    "MUL": 1, "DIV": 1, "AND": 0xff,
+}
+
+
+def ldi(labels, reg, value, line_num):
+    """A new LDI statement."""
+
+    st = Statement(labels, "LDI", line_num)
+    st.a = reg
+    st.b = value
+    st.text = f"LDI R{reg},{value}"
+    return st
+
+
+def remove(statements, i):
+    """Remove statement i, moving its labels onto the next statement."""
+
+    st = statements.pop(i)
+
+    if st.labels:
+        if i < len(statements):
+            statements[i].labels[:0] = st.labels
+        else:
+            statements.append(Statement(st.labels, None, st.line_num))
+
+
+def is_dead(statements, start, reg):
+    """
+    True if register reg is set again, from statement start on, before
+    anything reads it, in the same straight-line run of code.
+    """
+
+    for later in statements[start:]:
+        if later.labels or later.reads(reg):
+            return False
+
+        if later.writes(reg):
+            return True
+
+    return False
+
+
+def shorten_jump_chains(statements):
+    """
+    Point "LDI Rn,L / Jxx Rn" straight at T when L labels a trampoline,
+    "LDI Rn,T / JMP Rn" through the same register. Returns True if anything
+    changed.
+    """
+
+    # Rn still holds L after a conditional jump that isn't taken, and in a
+    # CALLed routine, so only a JMP, or a conditional jump that falls
+    # through to code setting Rn before it reads it, can be pointed at T
+
+    trampolines = {}
+
+    for st, nxt in zip(statements, statements[1:]):
+        if (st.labels and st.opcode == "LDI" and isinstance(st.b, str)
+                and nxt.opcode == "JMP" and nxt.a == st.a and not nxt.labels):
+            for label in st.labels:
+                trampolines[label] = (st.a, st.b)
+
+    changed = False
+
+    for i, (st, nxt) in enumerate(zip(statements, statements[1:])):
+        if not (st.opcode == "LDI" and nxt.opcode in JUMPS and nxt.a == st.a):
             continue
 
-        # print(line)  # debug
+        if nxt.opcode == "CALL" or (nxt.opcode != "JMP" and not is_dead(statements, i + 2, st.a)):
+            continue
 
-        m = re.match(REGEX, line)
+        target = st.b
+        seen = set()
 
-        if m is not None:
-            label, opcode, op_a, op_b = normalize_line(m.groups())
+        while target in trampolines and target not in seen:
+            seen.add(target)
+            reg, next_target = trampolines[target]
 
-            # print(label, opcode, op_a, op_b)  # debug
+            if reg != st.a:
+                break
 
-            # Track label address
-            if label is not None:
-                sym[label] = addr
-                # print(f"Label {label}: {addr}")  # debug
-                code.append(f'# {label} (address {addr}):')
+            target = next_target
 
-            if opcode is not None:
-                if opcode == 'DS':
-                    handle_ds(line)
-                elif opcode == 'DB':
-                    handle_db(line)
-                else:
-                    # Check operand count
-                    check_ops(opcode, op_a, op_b)
+        # A chain that loops back on itself is left alone
+        if target != st.b and target not in seen:
+            statements[i] = ldi(st.labels, st.a, target, st.line_num)
+            changed = True
+
+    return changed
+
+
+def remove_dead_code(statements):
+    """
+    Remove instructions that can't be reached: those after a JMP, RET, HLT
+    or IRET, up to the next label that something refers to. Data is always
+    kept. Returns True if anything changed.
+    """
+
+    referenced = {st.b for st in statements if st.opcode == "LDI" and isinstance(st.b, str)}
+    changed = False
+    dead = False
+    i = 0
+
+    while i < len(statements):
+        st = statements[i]
+
+        if any(label in referenced for label in st.labels) or st.data is not None:
+            dead = False
+
+        if dead and st.opcode is not None:
+            remove(statements, i)
+            changed = True
+            continue
+
+        if st.opcode in NO_FALL_THROUGH:
+            dead = True
+
+        i += 1
+
+    return changed
+
+
+def fold_registers(statements):
+    """
+    Follow the values loaded into registers through each straight-line run
+    of code, dropping LDIs of a value the register already holds and ALU
+    instructions that leave their register unchanged (such as adding a
+    register that was loaded with 0), and turning ALU instructions on two
+    known values into an LDI of the result. Returns True if anything
+    changed.
+    """
+
+    known = {}
+    changed = False
+    i = 0
+
+    while i < len(statements):
+        st = statements[i]
+        opcode = st.opcode
+
+        if st.labels or opcode is None or st.data is not None or opcode in ("CALL", "INT"):
+            known = {}
+
+        if st.a in SPECIAL_REGISTERS and opcode in WRITES_A:
+            pass
+
+        elif opcode == "LDI":
+            if known.get(st.a) == st.b:
+                remove(statements, i)
+                changed = True
+                continue
+
+            known[st.a] = st.b
+
+        elif opcode in FOLD:
+            a = known.get(st.a)
+            b = known.get(st.b)
+
+            if isinstance(b, int) and IDENTITY.get(opcode) == b and st.a != st.b:
+                remove(statements, i)
+                changed = True
+                continue
+
+            elif isinstance(a, int) and isinstance(b, int) and st.a != st.b:
+                value = FOLD[opcode](a, b)
+
+                if value is not None:
+                    value &= 0xff
+                    statements[i] = ldi(st.labels, st.a, value, st.line_num)
+                    known[st.a] = value
+                    changed = True
+                    i += 1
+                    continue
+
+            known.pop(st.a, None)
 
-                    # Handle opcodes
-                    op_info = OPCODES[opcode]
-                    handler = type_f[op_info["type"]]
-                    handler(opcode, op_a, op_b, op_info["code"])
         else:
-            print(f"No match: {input}", file=sys.stderr)
-            sys.exit(3)
+            for reg in list(known):
+                if st.writes(reg):
+                    del known[reg]
+
+        i += 1
 
+    return changed
 
-def pass2(outputfile, sym, code):
+
+def remove_dead_loads(statements):
+    """
+    Remove LDIs whose register is set again before anything reads it, in
+    the same straight-line run of code. Returns True if anything changed.
+    """
+
+    changed = False
+    i = 0
+
+    while i < len(statements):
+        st = statements[i]
+
+        if (st.opcode == "LDI" and st.a not in SPECIAL_REGISTERS
+                and is_dead(statements, i + 1, st.a)):
+            remove(statements, i)
+            changed = True
+            continue
+
+        i += 1
+
+    return changed
+
+
+def peephole(statements):
+    """
+    Optimize a statement list from parse(): shorten jump chains, remove
+    unreachable code, fold known register values and remove dead loads,
+    repeating until nothing changes.
+    """
+
+    statements = list(statements)
+
+    for _ in range(16):
+        changed = shorten_jump_chains(statements)
+        changed |= remove_dead_code(statements)
+        changed |= fold_registers(statements)
+        changed |= remove_dead_loads(statements)
+
+        if not changed:
+            break
+
+    return statements
+
+
+def resolve(program):
     """
-    Output the code, substituting in any symbols.
+    Patch the forward references left by pass1 with their label addresses.
     """
 
-    for c in code:
-        # Replace symbols
-        if c[:4] == 'sym:':
-            s = c[4:].strip()
+    code = program.code
+    sym = program.symbols
 
-            if s in sym:
-                c = p8(sym[s])
+    for offset, name, line_num in program.fixups:
+        if name not in sym:
+            raise AssemblyError(f"line {line_num}: unknown symbol: {name}")
 
-            else:
-                print(f"unknown symbol: {s}", file=sys.stderr)
-                sys.exit(2)
+        code[offset] = sym[name] & 0xff
 
-        outputfile.write(f"{c}\n")
+    program.fixups = []
+
+
+def to_text(program):
+    """
+    The .ls8 text for a program: one binary byte per line, with comments
+    if pass1 kept a listing.
+    """
+
+    code = program.code
+    comments = program.comments or {}
+    labels = program.labels
+    next_label = 0
+    lines = []
+
+    for addr, byte in enumerate(code):
+        while next_label < len(labels) and labels[next_label][0] == addr:
+            lines.append(f"# {labels[next_label][1]} (address {addr}):")
+            next_label += 1
+
+        comment = comments.get(addr)
+
+        if comment is None:
+            lines.append(f"{byte:08b}")
+        else:
+            lines.append(f"{byte:08b} # {comment}")
+
+    for addr, label in labels[next_label:]:
+        lines.append(f"# {label} (address {addr}):")
+
+    lines.append("")
+
+    return "\n".join(lines)
+
+
+def debug_map(program, source=None):
+    """
+    The debug map for a program, as UTF-8 JSON: the source file name, the
+    addresses and source line of each statement, and the range of
+    addresses each label covers (up to the next label, or the end of the
+    code):
+
+      {"source": "call.asm",
+       "lines": [[start, end, line], ...],
+       "labels": [[label, start, end], ...]}
+    """
+
+    end = len(program.code)
+    labels = sorted(program.labels)
+    ranges = []
+
+    for i, (addr, label) in enumerate(labels):
+        # Labels on the same address share the range
+        following = [a for a, _ in labels[i + 1:] if a > addr]
+        ranges.append([label, addr, following[0] if following else end])
+
+    debug = {
+        "source": source,
+        "lines": [list(line) for line in program.lines],
+        "labels": ranges,
+    }
+
+    return json.dumps(debug, separators=(",", ":")).encode("utf-8")
+
+
+def to_image(program, debug=b""):
+    """
+    The binary image for a program, with its symbol table and optionally a
+    debug section such as debug_map() returns.
+    """
+
+    out = io.BytesIO()
+
+    try:
+        image.write_image(out, bytes(program.code), 0, program.symbols, debug)
+
+    except ValueError as e:
+        raise AssemblyError(str(e))
+
+    return out.getvalue()
 
 
 def main(argv):
     # Parse command line
-    inputfile, outputfile = parse_commandline(argv)
+    inputfile, outputfile, optimize, debug = parse_commandline(argv)
+    binary = is_binary_output(outputfile)
+    source = None if inputfile == "-" else inputfile
+    map_path = None if binary else f"{outputfile}.map"
 
     # Open files
     inputfile, outputfile = open_files(inputfile, outputfile)
 
-    # Set up the symbol table
-    sym = {}
+    # Assemble
+    try:
+        program = pass1(inputfile, listing=not binary, optimize=optimize)
+        resolve(program)
+        debug_info = debug_map(program, source) if debug else b""
+        output = to_image(program, debug_info) if binary else None
+
+    except AssemblyError as e:
+        print(e, file=sys.stderr)
+        return e.status
+
+    if binary:
+        outputfile.write(output)
+    else:
+        outputfile.write(to_text(program))
 
-    # Set up the machine code output
-    code = []
+        if debug:
+            with open(map_path, "wb") as f:
+                f.write(debug_info)
 
-    # Assemble
-    pass1(inputfile, sym, code)
-    pass2(outputfile, sym, code)
+        elif outputfile is not sys.stdout and os.path.exists(map_path):
+            # A map from an earlier -g build no longer matches the code
+            os.remove(map_path)
 
     return 0
 
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+"""Build driver: assembles every changed .asm file, in parallel."""
+
+# Each source is hashed together with the assembler itself. Outputs are kept
+# in a cache under that key, so a source that hasn't changed (or has changed
+# back to something built before) is never assembled again, and a manifest
+# records which key each output was last written from, so an output that is
+# already up to date isn't even rewritten. Changing asm.py (or the image
+# module it writes binary images with) changes every key, which rebuilds
+# everything.
+#
+# Whatever does need assembling is spread over a process pool, all from this
+# one interpreter. With --watch, the sources (and the assembler) are polled
+# and rebuilt whenever they change.
+#
+# Example:
+#
+#  python build.py -j 8 -o ../ls8/examples '*.asm'
+#  python build.py --watch
+
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+
+import asm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(HERE, "__asmcache__")
+MANIFEST = "manifest.json"
+
+
+def assembler_version():
+    """
+    Hash of asm.py and ls8/image.py, so changing the assembler produces
+    fresh keys.
+    """
+
+    h = hashlib.sha256()
+
+    for path in assembler_files():
+        with open(path, "rb") as f:
+            h.update(f.read())
+
+    return h.digest()
+
+
+def assembler_files():
+    # The assembler's source files
+    return [asm.__file__, asm.image.__file__]
+
+
+def source_key(source, version, binary, optimize=False, debug=None):
+    """
+    Hash a source file's contents together with the assembler and the
+    output options. debug is the source's name when a debug map is wanted,
+    as the map records it.
+    """
+
+    h = hashlib.sha256(version)
+    h.update(b"ls8b" if binary else b"ls8")
+    h.update(b"-O" if optimize else b"")
+
+    if debug is not None:
+        h.update(b"-g" + debug.encode("utf-8") + b"\0")
+
+    h.update(source)
+    return h.hexdigest()[:32]
+
+
+def output_path(source, outdir, binary):
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.abspath(os.path.join(outdir, name + (".ls8b" if binary else ".ls8")))
+
+
+def output_suffixes(binary, debug):
+    # Files written for each source, as suffixes of its output path: a
+    # text output's debug map goes next to it
+    return ("", ".map") if debug is not None and not binary else ("",)
+
+
+def remove_stale(out, suffixes):
+    # A debug map left by an earlier -g build no longer matches the code
+    if ".map" not in suffixes and os.path.exists(out + ".map"):
+        os.remove(out + ".map")
+
+
+def assemble_source(source, binary, optimize=False, debug=None):
+    """
+    Assemble the bytes of one source file. Returns ({suffix: output bytes},
+    None), or (None, error message). With debug (the source's name), the
+    output includes a debug map.
+    """
+
+    try:
+        program = asm.pass1(source.decode("utf-8"), listing=not binary, optimize=optimize)
+        asm.resolve(program)
+        debug_info = asm.debug_map(program, debug) if debug is not None else b""
+
+        if binary:
+            return {"": asm.to_image(program, debug_info)}, None
+
+    except (asm.AssemblyError, UnicodeDecodeError) as e:
+        return None, str(e)
+
+    outputs = {"": asm.to_text(program).encode("utf-8")}
+
+    if debug is not None:
+        outputs[".map"] = debug_info
+
+    return outputs, None
+
+
+def assemble_job(job):
+    # Runs in the pool
+    return assemble_source(*job)
+
+
+def write_file(path, data):
+    # Write then rename, so nothing ever sees half a file
+    temp = path + ".tmp"
+
+    with open(temp, "wb") as f:
+        f.write(data)
+
+    os.replace(temp, path)
+
+
+def load_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST)) as f:
+            return json.load(f)
+
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(cache_dir, manifest):
+    write_file(os.path.join(cache_dir, MANIFEST),
+               json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8"))
+
+
+def build(sources, outdir, binary=False, jobs=None, cache_dir=CACHE_DIR, optimize=False,
+          debug=False):
+    """
+    Bring the outputs for sources up to date. Returns (built, reused,
+    skipped, failed) counts; errors are printed to stderr.
+    """
+
+    os.makedirs(outdir, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    version = assembler_version()
+    manifest = load_manifest(cache_dir)
+    pending = []
+    reused = skipped = 0
+
+    for source in sources:
+        with open(source, "rb") as f:
+            data = f.read()
+
+        name = source if debug else None
+        key = source_key(data, version, binary, optimize, name)
+        out = output_path(source, outdir, binary)
+        cached = os.path.join(cache_dir, key)
+        suffixes = output_suffixes(binary, name)
+
+        if manifest.get(out) == key and all(os.path.exists(out + s) for s in suffixes):
+            remove_stale(out, suffixes)
+            skipped += 1
+
+        elif all(os.path.exists(cached + s) for s in suffixes):
+            for suffix in suffixes:
+                with open(cached + suffix, "rb") as f:
+                    write_file(out + suffix, f.read())
+
+            remove_stale(out, suffixes)
+            manifest[out] = key
+            reused += 1
+
+        else:
+            pending.append((source, data, key, out))
+
+    jobs_list = [(data, binary, optimize, source if debug else None)
+                 for source, data, _, _ in pending]
+
+    if len(pending) > 1 and jobs != 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            workers = jobs or os.cpu_count() or 1
+            chunksize = max(1, len(pending) // (workers * 4))
+            results = list(pool.map(assemble_job, jobs_list, chunksize=chunksize))
+
+    else:
+        results = [assemble_job(job) for job in jobs_list]
+
+    built = failed = 0
+
+    for (source, _, key, out), (outputs, error) in zip(pending, results):
+        if error is not None:
+            print(f"{source}: {error}", file=sys.stderr)
+            manifest.pop(out, None)
+            failed += 1
+            continue
+
+        for suffix, output in outputs.items():
+            write_file(os.path.join(cache_dir, key) + suffix, output)
+            write_file(out + suffix, output)
+
+        remove_stale(out, tuple(outputs))
+
+        manifest[out] = key
+        built += 1
+
+    save_manifest(cache_dir, manifest)
+
+    return built, reused, skipped, failed
+
+
+def expand_sources(patterns):
+    """
+    Expand glob patterns into a sorted list of files.
+    """
+
+    sources = set()
+
+    for pattern in patterns:
+        matches = glob.glob(pattern)
+
+        if not matches and os.path.exists(pattern):
+            matches = [pattern]
+
+        sources.update(matches)
+
+    return sorted(sources)
+
+
+def snapshot_files(paths):
+    """
+    (mtime, size) for each path, to notice changes while watching.
+    """
+
+    stats = {}
+
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stats[path] = (st.st_mtime_ns, st.st_size)
+
+        except OSError:
+            pass
+
+    return stats
+
+
+def run_build(args):
+    sources = expand_sources(args.sources)
+    start = time.perf_counter()
+    built, reused, skipped, failed = build(sources, args.output, args.binary,
+                                           args.jobs, args.cache, args.optimize, args.debug)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(sources)} sources: {built} assembled, {reused} from cache, "
+          f"{skipped} up to date, {failed} failed ({elapsed:.2f}s)",
+          file=sys.stderr)
+
+    return failed
+
+
+def watch(args):
+    """
+    Rebuild whenever a source or the assembler changes, until interrupted.
+    """
+
+    global asm
+
+    watched = None
+
+    while True:
+        assembler = assembler_files()
+        files = snapshot_files(expand_sources(args.sources) + assembler)
+
+        if files != watched:
+            if watched is not None and any(files.get(f) != watched.get(f) for f in assembler):
+                # Pool workers are started afresh for each build, so they
+                # pick up the reloaded assembler too
+                try:
+                    importlib.reload(asm.image)
+                    asm = importlib.reload(asm)
+
+                except Exception as e:
+                    print(f"asm.py: {type(e).__name__}: {e}", file=sys.stderr)
+                    watched = files
+                    continue
+
+            watched = files
+            run_build(args)
+
+        time.sleep(args.interval)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("sources", nargs="*",
+                        default=[os.path.join(HERE, "*.asm")],
+                        help=".asm files or glob patterns (default: *.asm here)")
+    parser.add_argument("-o", "--output",
+                        default=os.path.join(HERE, "..", "ls8", "examples"),
+                        help="output directory (default: ../ls8/examples)")
+    parser.add_argument("-b", "--binary", action="store_true",
+                        help="write .ls8b binary images instead of .ls8 text")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="run the assembler's peephole optimizer")
+    parser.add_argument("-g", "--debug", action="store_true",
+                        help="write debug maps (see asm.debug_map)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--cache", default=CACHE_DIR,
+                        help="cache directory (default: __asmcache__ here)")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="keep running, rebuilding whatever changes")
+    parser.add_argument("--interval", type=float, default=0.5,
+                        help="seconds between checks in watch mode")
+    args = parser.parse_args(argv[1:])
+
+    if args.watch:
+        try:
+            watch(args)
+
+        except KeyboardInterrupt:
+            pass
+
+        return 0
+
+    return 1 if run_build(args) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,157 @@
+"""Tests for the assembler."""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import asm
+import build
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES = os.path.join(HERE, "..", "ls8", "examples")
+
+SOURCE = "LDI R0,8\nLoop: PRN R0\nHLT\n"
+
+
+class AssembleTest(unittest.TestCase):
+
+    def test_examples(self):
+        # The text serializer reproduces the checked-in .ls8 files
+        for name in ("call", "mult", "sctest", "stack", "interrupts", "keyboard"):
+            with open(os.path.join(HERE, name + ".asm")) as f:
+                program = asm.pass1(f, listing=True)
+
+            asm.resolve(program)
+
+            with open(os.path.join(EXAMPLES, name + ".ls8")) as f:
+                self.assertEqual(asm.to_text(program), f.read(), name)
+
+    def test_forward_reference(self):
+        self.assertEqual(asm.assemble("LDI R0,Fwd\nJMP R0\nFwd: HLT"),
+                         bytes([0b10000010, 0, 5, 0b01010100, 0, 0b00000001]))
+
+    def test_unknown_symbol(self):
+        with self.assertRaises(asm.AssemblyError):
+            asm.assemble("LDI R0,Nowhere\nHLT")
+
+    def test_duplicate_label(self):
+        # An LDI before the second definition would otherwise get the first
+        # address and one after it the second
+        with self.assertRaises(asm.AssemblyError):
+            asm.assemble("A: NOP\nA: HLT")
+
+    def test_image(self):
+        # Images are written by the emulator's image module and read back
+        program = asm.pass1(SOURCE)
+        asm.resolve(program)
+        ram = bytearray(256)
+        loaded = asm.image.read_image(io.BytesIO(asm.to_image(program, b"{}")), ram)
+        self.assertEqual(bytes(ram[:len(program.code)]), bytes(program.code))
+        self.assertEqual(loaded.symbols, {"LOOP": 3})
+        self.assertEqual(loaded.debug, b"{}")
+
+    def test_image_too_long(self):
+        program = asm.pass1("NOP\n" * 257)
+        asm.resolve(program)
+
+        with self.assertRaises(asm.AssemblyError):
+            asm.to_image(program)
+
+
+class OptimizerTest(unittest.TestCase):
+
+    def same(self, source):
+        # The optimizer leaves source alone
+        self.assertEqual(asm.assemble(source, optimize=True), asm.assemble(source))
+
+    def test_reload_removed(self):
+        self.assertEqual(asm.assemble("LDI R0,5\nLDI R0,5\nPRN R0\nHLT", optimize=True),
+                         asm.assemble("LDI R0,5\nPRN R0\nHLT"))
+
+    def test_dead_load_removed(self):
+        self.assertEqual(asm.assemble("LDI R0,1\nLDI R0,2\nPRN R0\nHLT", optimize=True),
+                         asm.assemble("LDI R0,2\nPRN R0\nHLT"))
+
+    def test_interrupt_mask_writes_kept(self):
+        self.same("LDI R5,1\nLDI R5,0\nHLT")
+        self.same("LDI R5,1\nNOP\nLDI R5,1\nHLT")
+
+    def test_special_registers_not_folded(self):
+        self.same("LDI R1,0\nLDI R5,2\nADD R5,R1\nHLT")
+        self.same("LDI R1,3\nLDI R6,2\nADD R6,R1\nHLT")
+
+    def test_stack_pointer_writes_kept(self):
+        self.same("LDI R7,0xF4\nLDI R7,0xF0\nHLT")
+
+    def test_labels_follow_removed_code(self):
+        source = "LDI R0,End\nJMP R0\nPRN R0\nEnd: HLT"
+        program = asm.pass1(source, optimize=True)
+        asm.resolve(program)
+        self.assertEqual(program.symbols["END"], 5)
+        self.assertEqual(program.code[2], 5)
+
+    def target(self, source):
+        # Where the first LDI points after optimizing, as a label
+        program = asm.pass1(source, optimize=True)
+        asm.resolve(program)
+        names = {address: name for name, address in program.symbols.items()}
+        return names[program.code[2]]
+
+    def test_jump_chain_shortened(self):
+        self.assertEqual(self.target("LDI R3,Tramp\nJMP R3\n"
+                                     "Tramp: LDI R3,Target\nJMP R3\nTarget: HLT"), "TARGET")
+
+    def test_jump_chain_kept_when_fall_through_reads(self):
+        # Not taken, the jump leaves R3 pointing at Tramp for PRN
+        self.assertEqual(self.target("LDI R3,Tramp\nJEQ R3\nPRN R3\nHLT\n"
+                                     "Tramp: LDI R3,Target\nJMP R3\nNOP\nTarget: HLT"), "TRAMP")
+
+    def test_jump_chain_shortened_when_fall_through_sets(self):
+        self.assertEqual(self.target("LDI R3,Tramp\nJEQ R3\nLDI R3,1\nPRN R3\nHLT\n"
+                                     "Tramp: LDI R3,Target\nJMP R3\nNOP\nTarget: HLT"), "TARGET")
+
+    def test_call_chain_kept(self):
+        self.assertEqual(self.target("LDI R3,Tramp\nCALL R3\nHLT\n"
+                                     "Tramp: LDI R3,Target\nJMP R3\nTarget: PRN R3\nRET"), "TRAMP")
+
+
+
+class DebugMapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.dir, "prog.asm")
+
+        with open(self.source, "w") as f:
+            f.write(SOURCE)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_main_removes_stale_map(self):
+        out = os.path.join(self.dir, "prog.ls8")
+        self.assertEqual(asm.main(["asm.py", "-g", self.source, out]), 0)
+        self.assertTrue(os.path.exists(out + ".map"))
+        self.assertEqual(asm.main(["asm.py", self.source, out]), 0)
+        self.assertFalse(os.path.exists(out + ".map"))
+
+    def test_build_removes_stale_map(self):
+        outdir = os.path.join(self.dir, "out")
+        cache = os.path.join(self.dir, "cache")
+        out = os.path.join(outdir, "prog.ls8")
+
+        build.build([self.source], outdir, jobs=1, cache_dir=cache, debug=True)
+        self.assertTrue(os.path.exists(out + ".map"))
+        build.build([self.source], outdir, jobs=1, cache_dir=cache)
+        self.assertFalse(os.path.exists(out + ".map"))
+
+        # And again when the outputs come from the cache
+        build.build([self.source], outdir, jobs=1, cache_dir=cache, debug=True)
+        build.build([self.source], outdir, jobs=1, cache_dir=cache)
+        self.assertFalse(os.path.exists(out + ".map"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+"""Lookup tables for the LS-8 ALU."""
+
+#Every two-register ALU instruction has an opcode of the form 0b1010xxxx, so
+#its low four bits pick its table. A table holds the 8-bit result (or, for
+#CMP, the flags) for every pair of register values, indexed by a << 8 | b,
+#which makes each ALU instruction a single lookup with the wraparound
+#already applied. Tables are 64 KiB each and built the first time they're
+#used, so programs only pay for the operations they run.
+#
+#DIV and MOD by zero aren't in the tables (they read as 0): the CPU checks
+#for them first, as it has to halt.
+
+#Low opcode bits -> what the table holds.
+OPERATIONS = {
+    0x0: lambda a, b: a + b,                  #ADD
+    0x1: lambda a, b: a - b,                  #SUB
+    0x2: lambda a, b: a * b,                  #MUL
+    0x3: lambda a, b: a // b if b else 0,     #DIV
+    0x4: lambda a, b: a % b if b else 0,      #MOD
+    0x5: lambda a, b: a + b,                  #ADDI, b being the immediate
+    0x7: lambda a, b: 0b00000001 if a == b else 0b00000010 if a > b else 0b00000100,  #CMP
+    0x8: lambda a, b: a & b,                  #AND
+    0xA: lambda a, b: a | b,                  #OR
+    0xB: lambda a, b: a ^ b,                  #XOR
+    0xC: lambda a, b: a << b,                 #SHL
+    0xD: lambda a, b: a >> b,                 #SHR
+}
+
+TABLES = [None] * 16
+
+#NOT only has one operand, so its table is small enough to build up front.
+NOT_TABLE = bytes(~a & 0xFF for a in range(256))
+
+
+def table(index):
+    """The table for the ALU instruction whose opcode ends in index."""
+    built = TABLES[index]
+    if built is None:
+        op = OPERATIONS[index]
+        built = TABLES[index] = bytes(op(a, b) & 0xFF for a in range(256) for b in range(256))
+    return built
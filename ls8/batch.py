@@ -0,0 +1,212 @@
+"""Lockstep execution of many LS-8 machines at once with NumPy."""
+
+#Every machine ("lane") runs the same kind of program on its own RAM and
+#registers. Each step fetches the current instruction of every running lane,
+#groups the lanes by opcode and applies that opcode to the whole group with
+#vector operations, so lanes that branch differently or halt early are
+#handled naturally. Registers wrap at 8 bits, as in the scalar CPU.
+#
+#Interrupts and the wall-clock timer aren't modelled: a lane that reaches an
+#instruction with no vector form (IRET or an unknown opcode) halts with its
+#error flag set.
+
+from array import array
+
+import numpy as np
+
+from cpu import *
+
+
+class BatchCPU:
+    """N LS-8 machines stored as NumPy arrays."""
+
+    def __init__(self, n):
+        self.n = n
+        self.ram = np.zeros((n, 256), dtype=np.uint8)
+        self.reg = np.zeros((n, 8), dtype=np.uint8)
+        self.reg[:, SP] = 0xF4
+        self.pc = np.zeros(n, dtype=np.int64)
+        self.fl = np.zeros(n, dtype=np.uint8)
+        self.halted = np.zeros(n, dtype=bool)
+        self.error = np.zeros(n, dtype=bool)
+        #PRN/PRA/AST output of each lane.
+        self.output = [[] for _ in range(n)]
+
+        self.ops = {
+            HLT: self.op_HLT,
+            LDI: self.op_LDI,
+            PRN: self.op_PRN,
+            PRA: self.op_PRA,
+            AST: self.op_AST,
+            PUSH: self.op_PUSH,
+            POP: self.op_POP,
+            CALL: self.op_CALL,
+            RET: self.op_RET,
+            ST: self.op_ST,
+            LD: self.op_LD,
+            JMP: self.op_JMP,
+            JEQ: self.op_JEQ,
+            JNE: self.op_JNE,
+            CMP: self.op_CMP,
+            ADD: self.alu_op(np.add),
+            SUB: self.alu_op(np.subtract),
+            MUL: self.alu_op(np.multiply),
+            AND: self.alu_op(np.bitwise_and),
+            OR: self.alu_op(np.bitwise_or),
+            XOR: self.alu_op(np.bitwise_xor),
+            SHL: self.alu_op(np.left_shift),
+            SHR: self.alu_op(np.right_shift),
+            DIV: self.divide_op(np.floor_divide),
+            MOD: self.divide_op(np.remainder),
+            NOT: self.op_NOT,
+            ADDI: self.op_ADDI,
+        }
+
+    def load(self, program):
+        """Copy the same program bytes into every lane's RAM at address 0."""
+        program = np.frombuffer(bytes(program), dtype=np.uint8)
+        self.ram[:, :len(program)] = program
+
+    def load_cpu(self, i, cpu):
+        """Set lane i to the state of a scalar CPU."""
+        self.ram[i] = np.frombuffer(bytes(cpu.ram), dtype=np.uint8)
+        self.reg[i] = np.frombuffer(cpu.reg.tobytes(), dtype=np.uint8)
+        self.pc[i] = cpu.pc
+        self.fl[i] = cpu.fl
+        self.halted[i] = cpu.halted
+
+    def to_cpu(self, i):
+        """Return a scalar CPU holding the state of lane i."""
+        cpu = CPU()
+        cpu.ram[:] = self.ram[i].tobytes()
+        cpu.reg[:] = array('B', self.reg[i].tobytes())
+        cpu.pc = int(self.pc[i])
+        cpu.fl = int(self.fl[i])
+        cpu.halted = bool(self.halted[i])
+        return cpu
+
+    def step(self):
+        """Execute one instruction on every running lane."""
+        lanes = np.flatnonzero(~self.halted)
+        if len(lanes) == 0:
+            return 0
+        pc = self.pc[lanes]
+        ir = self.ram[lanes, pc]
+        operand_a = self.ram[lanes, (pc + 1) & 0xFF].astype(np.int64)
+        operand_b = self.ram[lanes, (pc + 2) & 0xFF].astype(np.int64)
+
+        for op in np.unique(ir):
+            group = ir == op
+            handler = self.ops.get(int(op))
+            if handler is None:
+                self.fail(lanes[group])
+                continue
+            handler(lanes[group], operand_a[group], operand_b[group])
+            if not (op >> 4) & 1:
+                self.pc[lanes[group]] += (op >> 6) + 1
+
+        self.pc &= 0xFF
+        return len(lanes)
+
+    def run(self, max_steps=None):
+        """Step until every lane halts, or for at most max_steps steps."""
+        steps = 0
+        while not self.halted.all():
+            if max_steps is not None and steps >= max_steps:
+                break
+            self.step()
+            steps += 1
+        return steps
+
+    def fail(self, lanes):
+        #Lanes that can't continue stop where they are.
+        self.halted[lanes] = True
+        self.error[lanes] = True
+
+    #Vector forms of the instructions. Each gets the lanes it applies to and
+    #their decoded operands.
+
+    def op_HLT(self, lanes, a, b):
+        self.halted[lanes] = True
+
+    def op_LDI(self, lanes, a, b):
+        self.reg[lanes, a] = b
+
+    def op_PRN(self, lanes, a, b):
+        for lane, value in zip(lanes.tolist(), self.reg[lanes, a].tolist()):
+            self.output[lane].append(f"{value}\n")
+
+    def op_PRA(self, lanes, a, b):
+        for lane, value in zip(lanes.tolist(), self.reg[lanes, a].tolist()):
+            self.output[lane].append(chr(value))
+
+    def op_AST(self, lanes, a, b):
+        for lane, value in zip(lanes.tolist(), self.reg[lanes, a].tolist()):
+            self.output[lane].append("*" * value + "\n")
+
+    def op_PUSH(self, lanes, a, b):
+        sp = (self.reg[lanes, SP].astype(np.int64) - 1) & 0xFF
+        self.reg[lanes, SP] = sp
+        self.ram[lanes, sp] = self.reg[lanes, a]
+
+    def op_POP(self, lanes, a, b):
+        self.reg[lanes, a] = self.ram[lanes, self.reg[lanes, SP]]
+        self.reg[lanes, SP] = (self.reg[lanes, SP].astype(np.int64) + 1) & 0xFF
+
+    def op_CALL(self, lanes, a, b):
+        sp = (self.reg[lanes, SP].astype(np.int64) - 1) & 0xFF
+        self.reg[lanes, SP] = sp
+        self.ram[lanes, sp] = (self.pc[lanes] + 2) & 0xFF
+        self.pc[lanes] = self.reg[lanes, a]
+
+    def op_RET(self, lanes, a, b):
+        self.pc[lanes] = self.ram[lanes, self.reg[lanes, SP]]
+        self.reg[lanes, SP] = (self.reg[lanes, SP].astype(np.int64) + 1) & 0xFF
+
+    def op_ST(self, lanes, a, b):
+        self.ram[lanes, self.reg[lanes, a]] = self.reg[lanes, b]
+
+    def op_LD(self, lanes, a, b):
+        self.reg[lanes, a] = self.ram[lanes, self.reg[lanes, b]]
+
+    def op_JMP(self, lanes, a, b):
+        self.pc[lanes] = self.reg[lanes, a]
+
+    def op_JEQ(self, lanes, a, b):
+        self.pc[lanes] = np.where(self.fl[lanes] == 0b00000001, self.reg[lanes, a], self.pc[lanes] + 2)
+
+    def op_JNE(self, lanes, a, b):
+        self.pc[lanes] = np.where(self.fl[lanes] != 0b00000001, self.reg[lanes, a], self.pc[lanes] + 2)
+
+    def op_CMP(self, lanes, a, b):
+        x = self.reg[lanes, a]
+        y = self.reg[lanes, b]
+        self.fl[lanes] = np.where(x == y, 0b00000001, np.where(x > y, 0b00000010, 0b00000100))
+
+    def op_NOT(self, lanes, a, b):
+        self.reg[lanes, a] = ~self.reg[lanes, a]
+
+    def op_ADDI(self, lanes, a, b):
+        #operand_b is the immediate value, not a register.
+        self.reg[lanes, a] = (self.reg[lanes, a].astype(np.int64) + b) & 0xFF
+
+    def alu_op(self, ufunc):
+        #Builds the vector form of a two-register ALU instruction.
+        def op(lanes, a, b):
+            x = self.reg[lanes, a].astype(np.int64)
+            y = self.reg[lanes, b].astype(np.int64)
+            self.reg[lanes, a] = ufunc(x, y) & 0xFF
+        return op
+
+    def divide_op(self, ufunc):
+        #Like alu_op, but lanes dividing by zero halt with an error, moving
+        #past the instruction like the scalar CPU does.
+        def op(lanes, a, b):
+            x = self.reg[lanes, a].astype(np.int64)
+            y = self.reg[lanes, b].astype(np.int64)
+            zero = y == 0
+            if zero.any():
+                self.fail(lanes[zero])
+            ok = ~zero
+            self.reg[lanes[ok], a[ok]] = ufunc(x[ok], y[ok]) & 0xFF
+        return op
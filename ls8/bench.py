@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+"""Benchmarks for the LS-8 emulator."""
+
+#Three kinds of workload:
+#
+#* micro: tight loops around one kind of instruction (ADD, MUL, CMP/JEQ,
+#  PUSH/POP, CALL/RET), run for a fixed number of cycles.
+#* example: the programs in examples/ that run to HLT.
+#* synthetic: longer programs generated as assembly and put through
+#  asm/asm.py.
+#
+#For each one it reports instructions per second, ns per instruction,
+#startup time (building a CPU and loading the program) and peak memory.
+#Results can be saved as a JSON baseline, and a later run compared with it:
+#
+#  python bench.py --save baseline.json
+#  python bench.py --compare baseline.json --threshold 0.1
+#
+#The comparison fails (exit status 1) if any benchmark's throughput dropped
+#by more than the threshold.
+
+import io
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import contextlib
+import tracemalloc
+
+from cpu import *
+from output import NullOutput
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "asm"))
+import asm
+
+#Every micro benchmark loops forever; R4 holds the loop address.
+MICRO = {
+    "ADD": """
+        LDI R0,0
+        LDI R1,1
+        LDI R4,Loop
+    Loop:
+        ADD R0,R1
+        ADD R0,R1
+        ADD R0,R1
+        JMP R4
+    """,
+    "MUL": """
+        LDI R0,3
+        LDI R1,7
+        LDI R4,Loop
+    Loop:
+        MUL R0,R1
+        MUL R0,R1
+        MUL R0,R1
+        JMP R4
+    """,
+    "CMP/JEQ": """
+        LDI R0,1
+        LDI R1,1
+        LDI R4,Loop
+    Loop:
+        CMP R0,R1
+        JEQ R4
+    """,
+    "PUSH/POP": """
+        LDI R0,42
+        LDI R4,Loop
+    Loop:
+        PUSH R0
+        POP R1
+        PUSH R1
+        POP R0
+        JMP R4
+    """,
+    "CALL/RET": """
+        LDI R4,Loop
+        LDI R2,Sub
+    Loop:
+        CALL R2
+        JMP R4
+    Sub:
+        RET
+    """,
+}
+
+
+def synthetic_loops(outer, inner):
+    """
+    Nested countdown loops with some arithmetic in the body; runs to HLT
+    after roughly outer * inner * 6 instructions.
+    """
+
+    return f"""
+        LDI R0,{outer}
+        LDI R2,1
+        LDI R3,0
+        LDI R4,Outer
+        LDI R5,Inner
+    Outer:
+        LDI R1,{inner}
+    Inner:
+        ADD R6,R2
+        XOR R6,R1
+        SUB R1,R2
+        CMP R1,R3
+        JNE R5
+        SUB R0,R2
+        CMP R0,R3
+        JNE R4
+        PRN R6
+        HLT
+    """
+
+
+def synthetic_calls(n):
+    """
+    A countdown loop calling a subroutine that pushes and pops its work.
+    """
+
+    return f"""
+        LDI R0,{n}
+        LDI R2,1
+        LDI R3,0
+        LDI R4,Loop
+        LDI R5,Work
+    Loop:
+        CALL R5
+        SUB R0,R2
+        CMP R0,R3
+        JNE R4
+        HLT
+    Work:
+        PUSH R0
+        MUL R0,R0
+        ADD R1,R0
+        POP R0
+        RET
+    """
+
+
+SYNTHETIC = {
+    "loops-200x200": synthetic_loops(200, 200),
+    "calls-250": synthetic_calls(250),
+}
+
+
+def assemble(source):
+    """
+    Assemble source with asm.py and return the .ls8 text.
+    """
+
+    program = asm.pass1(source)
+    asm.resolve(program)
+    return asm.to_text(program)
+
+
+def make_cpu(program):
+    cpu = CPU()
+    cpu.output = NullOutput()
+    cpu.load(io.StringIO(program))
+    return cpu
+
+
+def run_cpu(cpu, engine, max_cycles):
+    if engine == "blocks":
+        return cpu.run_blocks(max_cycles)
+    return cpu.run(max_cycles)
+
+
+def measure(name, kind, program, engine, max_cycles, repeat, min_time):
+    """
+    Benchmark one program and return its result row.
+    """
+
+    #Peak memory comes from a separate, untimed run under tracemalloc.
+    tracemalloc.start()
+    run_cpu(make_cpu(program), engine, max_cycles)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = None
+    startup = None
+    for _ in range(repeat):
+        cycles = 0
+        elapsed = 0.0
+        #Short programs are rerun until there's enough time to measure.
+        while elapsed < min_time:
+            start = time.perf_counter()
+            cpu = make_cpu(program)
+            loaded = time.perf_counter()
+            cycles += run_cpu(cpu, engine, max_cycles)
+            elapsed += time.perf_counter() - loaded
+            if startup is None or loaded - start < startup:
+                startup = loaded - start
+        ips = cycles / elapsed
+        if best is None or ips > best:
+            best = ips
+
+    return {
+        "name": name,
+        "kind": kind,
+        "engine": engine,
+        "ips": best,
+        "ns_per_instruction": 1e9 / best,
+        "startup_s": startup,
+        "peak_memory_bytes": peak,
+    }
+
+
+def benchmarks(args):
+    """
+    Yield (name, kind, program text, max_cycles) for every benchmark.
+    """
+
+    for name, source in MICRO.items():
+        yield f"micro:{name}", "micro", assemble(source), args.cycles
+
+    for path in sorted(glob.glob(os.path.join(HERE, "examples", "*.ls8"))):
+        with open(path) as f:
+            program = f.read()
+        #Only programs that run to HLT on their own make sense here.
+        cpu = make_cpu(program)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_cpu(cpu, args.engine, args.cycles)
+        except (SystemExit, Exception):
+            continue
+        if cpu.halted:
+            yield f"example:{os.path.basename(path)}", "example", program, None
+
+    for name, source in SYNTHETIC.items():
+        yield f"synthetic:{name}", "synthetic", assemble(source), None
+
+
+def compare(results, baseline, threshold):
+    """
+    Return the names of benchmarks whose throughput dropped by more than
+    threshold compared to the baseline.
+    """
+
+    before = {r["name"]: r for r in baseline["results"]}
+    slower = []
+    for r in results:
+        old = before.get(r["name"])
+        if old is None:
+            continue
+        change = r["ips"] / old["ips"] - 1
+        r["change"] = change
+        if change < -threshold:
+            slower.append(r["name"])
+    return slower
+
+
+def print_table(results):
+    print(f"{'benchmark':32} {'instr/s':>12} {'ns/instr':>9} {'startup us':>10} {'peak KiB':>9} {'change':>8}")
+    for r in results:
+        change = f"{r['change']:+.1%}" if "change" in r else ""
+        print(f"{r['name']:32} {r['ips']:12,.0f} {r['ns_per_instruction']:9.1f} "
+              f"{r['startup_s'] * 1e6:10.1f} {r['peak_memory_bytes'] / 1024:9.1f} {change:>8}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--engine", choices=["run", "blocks"], default="run",
+                        help="CPU.run or CPU.run_blocks (default: run)")
+    parser.add_argument("--cycles", type=int, default=200000,
+                        help="cycles per micro benchmark run (default: 200000)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per benchmark; the best counts (default: 3)")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="seconds each timed run lasts at least (default: 0.2)")
+    parser.add_argument("-k", "--filter", default="",
+                        help="only run benchmarks whose name contains this")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="allowed throughput drop against the baseline (default: 0.1)")
+    args = parser.parse_args(argv[1:])
+
+    results = []
+    for name, kind, program, max_cycles in benchmarks(args):
+        if args.filter not in name:
+            continue
+        results.append(measure(name, kind, program, args.engine, max_cycles,
+                               args.repeat, args.min_time))
+
+    slower = []
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.threshold)
+
+    print_table(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"engine": args.engine, "python": sys.version.split()[0],
+                       "results": results}, f, indent=2)
+            f.write("\n")
+
+    if slower:
+        print(f"Throughput dropped more than {args.threshold:.0%}: {', '.join(slower)}",
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
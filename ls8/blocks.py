@@ -0,0 +1,159 @@
+"""Basic-block translation engine for the LS-8 CPU."""
+
+#A basic block is a run of instructions ending at the first one that sets
+#the PC itself (JMP, JEQ, JNE, CALL, RET, IRET) or halts. Each block is
+#turned into Python source with its operands baked in as constants, compiled
+#once and cached by start address.
+
+#Longest block we'll translate before falling through to the next one.
+MAX_BLOCK = 64
+
+#Inline source for instructions simple enough not to need their handler.
+#{a}/{b} are the decoded operands, {next} is the address of the next instruction
+#and {target} is the jump target: reg[{a}], or a constant when an LDI earlier
+#in the block already fixed that register.
+TEMPLATES = {
+    "LDI": "reg[{a}] = {b}",
+    "ADD": "reg[{a}] = (reg[{a}] + reg[{b}]) & 0xFF",
+    "SUB": "reg[{a}] = (reg[{a}] - reg[{b}]) & 0xFF",
+    "MUL": "reg[{a}] = (reg[{a}] * reg[{b}]) & 0xFF",
+    "AND": "reg[{a}] = reg[{a}] & reg[{b}]",
+    "OR": "reg[{a}] = reg[{a}] | reg[{b}]",
+    "XOR": "reg[{a}] = reg[{a}] ^ reg[{b}]",
+    "CMP": "x = reg[{a}]; y = reg[{b}]\n"
+           "cpu.fl = 0b00000001 if x == y else 0b00000010 if x > y else 0b00000100",
+    "JMP": "cpu.pc = {target}",
+    "JEQ": "cpu.pc = {target} if cpu.fl == 0b00000001 else {next}",
+    "JNE": "cpu.pc = {target} if cpu.fl != 0b00000001 else {next}",
+    "HLT": "cpu.halted = True\ncpu.pc = {next}",
+}
+
+#Instructions that write ram. Another instruction later in the same block
+#might be the one that got overwritten, so the block bails out afterwards.
+WRITES_RAM = {"ST", "PUSH"}
+
+#Instructions that leave every register but the stack pointer alone.
+KEEPS_REGS = {"CMP", "PRN", "PRA", "AST", "ST", "PUSH", "JMP", "JEQ", "JNE"}
+
+#Instructions that halt the CPU on an error (division by zero).
+MAY_HALT = {"DIV", "MOD"}
+
+SP = 7
+
+
+class BlockCache:
+    """Translated blocks for one CPU, keyed by start address."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.blocks = {}
+        #For every ram address, the start addresses of blocks that cover it.
+        self.owners = [set() for _ in range(len(cpu.ram))]
+        #Set when a write drops a block, so a running block can stop early.
+        self.stale = False
+
+    def get(self, address):
+        block = self.blocks.get(address)
+        if block is None:
+            if address >= len(self.cpu.ram):
+                self.cpu.ran_off_end()
+            block = self.translate(address)
+        return block
+
+    def invalidate(self, address):
+        #Drops every block whose code covers address.
+        starts = self.owners[address]
+        if not starts:
+            return
+        for start in list(starts):
+            block = self.blocks.pop(start, None)
+            if block is not None:
+                for addr in block.covers:
+                    self.owners[addr].discard(start)
+        self.stale = True
+
+    def clear(self):
+        self.blocks = {}
+        self.owners = [set() for _ in range(len(self.cpu.ram))]
+
+    def translate(self, start):
+        #Finds the basic block at start, compiles it and caches it.
+        source, end, targets = self.block_source(start)
+        namespace = {}
+        exec(compile(source, f"<ls8 block {start:#04x}>", "exec"), namespace)
+        return self.install(start, namespace["block"], end)
+
+    def install(self, start, block, end):
+        #Caches an already compiled block covering start up to end.
+        block.covers = range(start, end)
+        self.blocks[start] = block
+        for addr in block.covers:
+            self.owners[addr].add(start)
+        return block
+
+    def block_source(self, start, function="block"):
+        #Returns the source of the block function at start, the address just
+        #past its last byte, and the addresses execution can continue at when
+        #they are known without running it.
+        cpu = self.cpu
+        lines = [f"def {function}(cpu):", "    reg = cpu.reg"]
+        address = start
+        count = 0
+        #Registers holding a constant loaded by an LDI in this block.
+        known = {}
+        targets = []
+        while True:
+            handler, operand_a, operand_b, size, sets_pc, steps = cpu.decode_one(address)
+            name = handler.__name__[len("execute_"):]
+            following = address + size
+            count += steps
+
+            target = known.get(operand_a, f"reg[{operand_a}]")
+            template = TEMPLATES.get(name)
+            if template is not None:
+                code = template.format(a=operand_a, b=operand_b, next=following, target=target)
+            elif name == "unknown":
+                code = f"cpu.pc = {address}\ncpu.ir = {cpu.ram[address]}\ncpu.execute_unknown(0, 0)"
+            else:
+                #Anything else goes through its handler, with the PC it expects.
+                code = f"cpu.pc = {address}\ncpu.execute_{name}({operand_a}, {operand_b})"
+            if cpu.touches_interrupts(cpu.ram[address], operand_a):
+                code += "\ncpu.intc.update()"
+            lines.extend("    " + line for line in code.split("\n"))
+
+            if name == "LDI":
+                known[operand_a] = operand_b
+            elif name in KEEPS_REGS:
+                known.pop(SP, None)
+            elif name in TEMPLATES:
+                known.pop(operand_a, None)
+            else:
+                known = {}
+
+            if sets_pc or name in ("HLT", "unknown"):
+                if isinstance(target, int) and name in ("JMP", "JEQ", "JNE", "CALL"):
+                    targets.append(target)
+                if name in ("JEQ", "JNE", "CALL"):
+                    #CALL comes back here through RET.
+                    targets.append(following)
+                lines.append(f"    return {count}")
+                break
+
+            if name in MAY_HALT:
+                lines.append("    if cpu.halted:")
+                lines.append(f"        cpu.pc = {following}")
+                lines.append(f"        return {count}")
+
+            if name in WRITES_RAM:
+                lines.append("    if cpu.blocks.stale:")
+                lines.append(f"        cpu.pc = {following}")
+                lines.append(f"        return {count}")
+
+            if count >= MAX_BLOCK or following >= len(cpu.ram):
+                lines.append(f"    cpu.pc = {following}")
+                lines.append(f"    return {count}")
+                targets.append(following)
+                break
+            address = following
+
+        return "\n".join(lines) + "\n", min(following, len(cpu.ram)), targets
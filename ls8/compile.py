@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""Ahead-of-time compiler: turns a .ls8 image into a cached Python module."""
+
+#The module holds the image bytes and one function per basic block reachable
+#from the entry point, generated by the same translator run_blocks uses. It is
+#cached under a hash of the image, so later runs of the same program just
+#import it (Python keeps the bytecode in __pycache__) and skip both parsing
+#the text and translating blocks. Blocks it couldn't find statically, like
+#interrupt handlers, are still translated on the fly.
+
+import sys
+import os.path
+import hashlib
+import importlib.util
+import py_compile
+
+from cpu import *
+from blocks import BlockCache
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(HERE, "__ls8cache__")
+
+
+#The translator, and the CPU code whose handlers and decode records it
+#builds on. A change to any of them invalidates every cached module.
+TRANSLATOR = ("blocks.py", "cpu.py", "alu.py", "interrupts.py")
+
+
+def image_key(image):
+    """
+    Hash the image together with the translator and the CPU, so changing
+    any of them produces a fresh module.
+    """
+
+    h = hashlib.sha256(image)
+    for name in TRANSLATOR:
+        h.update(name.encode())
+        with open(os.path.join(HERE, name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:32]
+
+
+def translate(cpu, name):
+    """
+    Generate the module source for the program loaded in cpu, starting
+    from its entry point.
+    """
+
+    blocks = BlockCache(cpu)
+    used = len(cpu.ram)
+    while used > 0 and cpu.ram[used - 1] == 0:
+        used -= 1
+
+    lines = [
+        f'"""Compiled from {name} by compile.py. Do not edit."""',
+        "",
+        f'IMAGE = bytes.fromhex("{bytes(cpu.ram[:used]).hex()}")',
+        f"ENTRY = {cpu.pc}",
+        "",
+    ]
+    ends = {}
+    pending = [cpu.pc]
+    while pending:
+        start = pending.pop()
+        if start in ends or start >= len(cpu.ram):
+            continue
+        source, end, targets = blocks.block_source(start, f"block_{start:02x}")
+        ends[start] = end
+        lines.append(source)
+        pending.extend(targets)
+
+    lines.append("BLOCKS = {")
+    for start in sorted(ends):
+        lines.append(f"    {start}: (block_{start:02x}, {ends[start]}),")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def load_module(key, path):
+    spec = importlib.util.spec_from_file_location(f"ls8_{key}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def compile_program(filename):
+    """
+    Return the compiled module for the .ls8 file, building it if needed.
+    """
+
+    with open(filename, "rb") as f:
+        key = image_key(f.read())
+
+    path = os.path.join(CACHE_DIR, f"ls8_{key}.py")
+    if not os.path.exists(path):
+        cpu = CPU()
+        cpu.load(filename)
+        source = translate(cpu, os.path.basename(filename))
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        #Write then rename so a concurrent run never imports half a module.
+        with open(path + ".tmp", "w") as f:
+            f.write(source)
+        os.replace(path + ".tmp", path)
+        #Byte-compile up front, even when the interpreter wouldn't write it.
+        py_compile.compile(path, doraise=True)
+
+    return load_module(key, path)
+
+
+def run_compiled(module):
+    """
+    Set up a CPU from a compiled module and run it.
+    """
+
+    cpu = CPU()
+    cpu.ram[:len(module.IMAGE)] = module.IMAGE
+    cpu.pc = module.ENTRY
+    cpu.blocks = BlockCache(cpu)
+    for start, (block, end) in module.BLOCKS.items():
+        cpu.blocks.install(start, block, end)
+    cpu.run_blocks()
+    return cpu
+
+
+def main(argv):
+    """
+    Usage: compile.py program.ls8
+    """
+
+    if len(argv) != 2:
+        print("usage: compile.py program.ls8", file=sys.stderr)
+        return 1
+
+    #Like ls8.py, programs can be named by path or by file name in examples/.
+    filename = argv[1]
+    if not os.path.exists(filename):
+        filename = os.path.join(HERE, "examples", argv[1])
+    if not os.path.exists(filename):
+        print(f"Could not find file named: {argv[1]}")
+        return 1
+
+    run_compiled(compile_program(filename))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,12 +1,24 @@
 """CPU functionality."""
 
-#import msvcrt
+import io
 import sys
+import time
 import os.path
-from datetime import datetime
+from array import array
+
+from alu import TABLES as ALU_TABLES, NOT_TABLE, table as alu_table
+from blocks import BlockCache
+from debugmap import read_map
+from image import is_image, is_image_file, read_image, read_text
+from interrupts import InterruptController, Idle
+from output import BufferedOutput
+import snapshot
+from timer import Timer, VIRTUAL
+from tracer import format_record
 
 HLT  = 0b00000001
 LDI  = 0b10000010
+LD   = 0b10000011
 PRN  = 0b01000111
 MUL  = 0b10100010
 PUSH = 0b01000101
@@ -41,20 +53,99 @@ SP = 7
 IS_TIMER = 0b00000001
 IS_KEYBOARD = 0b00000010
 
+#Instructions that write the register named by operand_a.
+WRITES_REG_A = {LDI, LD, POP, ADD, SUB, MUL, DIV, MOD, AND, OR, XOR, NOT, SHL, SHR, ADDI}
+
+#Instructions that only change registers and flags, and can't halt.
+PURE = {LDI, CMP, ADD, SUB, MUL, AND, OR, XOR, NOT, SHL, SHR, ADDI}
+
+#Stands in for "no budget" in run's loop.
+NO_LIMIT = 1 << 62
+
+#Longest loop (in bytes) checked for spinning without side effects.
+MAX_SPIN_LOOP = 16
+
+#Instructions that can start a fused pair, jumps that can be fused with an
+#LDI of their target register, and the longest run of bytes a fused record
+#covers (LDI + ADD).
+FUSE_FIRST = {LDI, CMP}
+FUSE_JUMPS = {JMP, JEQ, JNE, CALL}
+MAX_SPAN = 6
+
+
+def alu_instruction(name, op):
+    #Makes the execute_ method for a two-register ALU instruction: a single
+    #lookup in the table picked by the opcode's low bits.
+    index = op & 0x0F
+    def execute(self, operand_a, operand_b):
+        reg = self.reg
+        reg[operand_a] = (ALU_TABLES[index] or alu_table(index))[reg[operand_a] << 8 | reg[operand_b]]
+    execute.__name__ = f"execute_{name}"
+    return execute
+
+
+def alu_division(name, op):
+    #The same for DIV and MOD, which halt instead when dividing by zero.
+    index = op & 0x0F
+    def execute(self, operand_a, operand_b):
+        reg = self.reg
+        divisor = reg[operand_b]
+        if divisor == 0:
+            self.divide_by_zero()
+        else:
+            reg[operand_a] = (ALU_TABLES[index] or alu_table(index))[reg[operand_a] << 8 | divisor]
+    execute.__name__ = f"execute_{name}"
+    return execute
+
+
+class ExternalWakeup:
+    """
+    Stand-in for CPU.wakeup when something else does the waiting for an idle
+    CPU: run() stops by raising Idle instead of sleeping, and a device waking
+    the CPU calls callback (from its own thread).
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def set(self):
+        self.callback()
+
+    def clear(self):
+        pass
+
+
+class AsyncWakeup(ExternalWakeup):
+    """CPU.wakeup while run_async runs: wakes the coroutine."""
+
+    def __init__(self, loop):
+        import asyncio
+        self.event = asyncio.Event()
+        super().__init__(lambda: loop.call_soon_threadsafe(self.event.set))
+
+    def clear(self):
+        self.event.clear()
+
 
 class CPU:
     """Main CPU class."""
 
+    #Fixed attributes keep each CPU small when lots of them are kept around.
+    __slots__ = ('ram', 'reg', 'pc', 'ir', 'mar', 'mdr', 'fl', 'halted', 'cycles',
+                 'ie', 'intc', 'timer', 'keyboard', 'wakeups', 'wakeup', 'spin_state', 'symbols', 'debug_info', 'output',
+                 'branchtable', 'decoded', 'fuse', 'blocks', 'profiler', 'tracer')
+
     def __init__(self):
         """Construct a new CPU."""
         # 256-byte RAM, each element is 1 byte. Can only store integers 0-255
-        self.ram = [0] *256
+        self.ram = bytearray(256)
 
-        #R0-R7: 8-bit registers.
+        #R0-R7: 8-bit registers. Storing anything outside 0-255 raises an
+        #OverflowError, so results have to be masked first.
         #R5= interrupt mask (IM)
         #R6= Interrupt status (IS)
         #R7= stack pointer (SP)
-        self.reg = [0] * 8
+        self.reg = array('B', [0] * 8)
 
         # Internal Registers
         self.pc = 0 #Program Counter: address of currently executing instruction
@@ -63,6 +154,7 @@ class CPU:
         self.mdr = 0 #Memory Data Register: holds the value to write or the value to read.
         self.fl = 0b00000000 #Flag Register: holds the current flags status *might change
         self.halted = False
+        self.cycles = 0 #Instructions executed so far.
 
         #Initialize the Stack Pointer
         #SP points at the value at the top of the stack (most recently pushed), or at address F4.
@@ -70,7 +162,24 @@ class CPU:
 
         #Test case for interrupts to be functioning.
         self.ie = 1
-        self.last_timer_int = None
+        self.intc = InterruptController(self)
+        self.timer = Timer()
+        #The Keyboard attached to this CPU, if any.
+        self.keyboard = None
+
+        #Interrupts that something can raise while the CPU spins in place,
+        #and an optional threading.Event that devices set when they do.
+        self.wakeups = IS_TIMER
+        self.wakeup = None
+        #Loop bounds and state at the last backward jump, to spot spinning.
+        self.spin_state = None
+
+        #Label addresses and debug data from a binary image.
+        self.symbols = {}
+        self.debug_info = b""
+
+        #Where PRN, PRA and AST write to.
+        self.output = BufferedOutput()
 
         #Set up Branch Table (will add more as we go):
         self.branchtable = {}
@@ -101,24 +210,23 @@ class CPU:
         self.branchtable[IRET] = self.execute_IRET
         self.branchtable[PRA] = self.execute_PRA
         self.branchtable[ST] = self.execute_ST
+        self.branchtable[LD] = self.execute_LD
+
+        #Predecode cache: one (handler, operand_a, operand_b, size, sets_pc,
+        #count) record per address, filled in the first time that address
+        #executes. count is the number of instructions the record runs: 2
+        #for fused pairs (see fuse_pair), which are only made while fuse is
+        #set.
+        self.decoded = [None] * len(self.ram)
+        self.fuse = True
+        #Translated basic blocks, created the first time run_blocks is used.
+        self.blocks = None
+        #Set to a profiler.Profiler or tracer.Tracer to have run use its
+        #instrumented loop instead.
+        self.profiler = None
+        self.tracer = None
 
     # Property wrapper is very powerful to set/get function.
-    @property
-    def sp(self): #Gets Stack Pointer
-        return self.reg[7]
-    
-    @sp.setter
-    def sp(self, a): #Sets Stack Pointer
-        self.reg[7] = a & 0xFF
-
-    @property
-    def operand_a(self): #Sets operand_a when necessary.
-        return self.ram_read(self.pc + 1)
-    
-    @property
-    def operand_b(self): #Sets operand_b when necessary.
-        return self.ram_read(self.pc + 2)
-    
     @property
     def instruction_size(self): #Taken from lecture short-hand. 
         #The first 2 places of the command are how many instructions to do.
@@ -142,335 +250,558 @@ class CPU:
     def ram_write(self, mar, mdr):
         if mar >= 0 and mar < len(self.ram):
             self.ram[mar] = mdr & 0xFF
+            self.invalidate(mar)
         elif mar == 17:
             print("Here it is.")
         else:
             print(f'Error: attempted to write to memory address: {mar}, which is outside the memory.')
 
-    def load(self):
+    def decode(self, address):
+        #Decodes the instruction at address once and caches the record.
+        record = None
+        if self.fuse and self.ram[address] in FUSE_FIRST:
+            record = self.fuse_pair(address)
+        if record is None:
+            record = self.decode_one(address)
+        self.decoded[address] = record
+        return record
+
+    def decode_one(self, address):
+        #The record for just the instruction at address, not cached.
+        ir = self.ram[address]
+        size = ((ir >> 6) & 0b11) + 1
+        operand_a = self.ram_read(address + 1) if size > 1 else 0
+        operand_b = self.ram_read(address + 2) if size > 2 else 0
+        handler = self.branchtable.get(ir)
+        if handler is None:
+            handler = self.execute_unknown
+        elif self.touches_interrupts(ir, operand_a):
+            handler = self.updating_interrupts(handler)
+        return (handler, operand_a, operand_b, size, ((ir >> 4) & 0b0001) == 1, 1)
+
+    def fuse_pair(self, address):
+        #Superinstructions: a record running two instructions that often
+        #come together, for one trip round the run loop instead of two.
+        #  LDI rX,v + JMP/JEQ/JNE/CALL rX    execute_LDI_jump
+        #  CMP rA,rB + JEQ/JNE rC            execute_CMP_jump
+        #  LDI rX,v + ADD rY,rX              execute_LDI_ADD
+        #operand_b becomes a tuple of everything else the pair needs.
+        #Returns None if the instruction at address doesn't start one.
+        #Both LDI and CMP are 3 bytes long.
+        ram = self.ram
+        if address + 5 >= len(ram):
+            return None
+        ir = ram[address]
+        operand_a, operand_b = ram[address + 1], ram[address + 2]
+        next_ir, next_a = ram[address + 3], ram[address + 4]
+        if ir == CMP:
+            if next_ir == JEQ or next_ir == JNE:
+                return (self.execute_CMP_jump, operand_a, (operand_b, next_a, next_ir == JEQ), 5, True, 2)
+        elif operand_a == IM or operand_a == IS:
+            return None
+        elif next_ir in FUSE_JUMPS:
+            if next_a == operand_a:
+                return (self.execute_LDI_jump, operand_a, (operand_b, self.branchtable[next_ir]), 5, True, 2)
+        elif next_ir == ADD:
+            if ram[address + 5] == operand_a and next_a != IM and next_a != IS:
+                return (self.execute_LDI_ADD, operand_a, (operand_b, next_a), 6, False, 2)
+        return None
+
+    def unfuse(self):
+        #Stops fusing instructions and drops the fused records, for the
+        #profiler and tracer, which want one record per instruction.
+        self.fuse = False
+        decoded = self.decoded
+        for address, record in enumerate(decoded):
+            if record is not None and record[5] != 1:
+                decoded[address] = None
+
+    def touches_interrupts(self, ir, operand_a):
+        #True if the instruction writes IM or IS.
+        return ir in WRITES_REG_A and operand_a in (IM, IS)
+
+    def updating_interrupts(self, handler):
+        #Wraps a handler so the interrupt controller sees its IM/IS write.
+        intc = self.intc
+        def execute(operand_a, operand_b):
+            handler(operand_a, operand_b)
+            intc.update()
+        execute.__name__ = handler.__name__
+        return execute
+
+    def invalidate(self, address):
+        #A write can change the opcode or operands of any record that covers
+        #this address: at most MAX_SPAN bytes long, for fused pairs.
+        decoded = self.decoded
+        for addr in range(max(address - MAX_SPAN + 1, 0), address + 1):
+            decoded[addr] = None
+        if self.blocks is not None:
+            self.blocks.invalidate(address)
+
+    def invalidate_range(self, start, end):
+        #Same as invalidate for every address in start..end-1.
+        first = max(start - MAX_SPAN + 1, 0)
+        self.decoded[first:end] = [None] * (end - first)
+        if self.blocks is not None:
+            for address in range(start, end):
+                self.blocks.invalidate(address)
+
+    def load(self, source):
         """Load a program into memory.
+        source is a path or file object holding either a binary image (see
+        image.py) or the text .ls8 format, told apart by the image's magic
+        bytes. Binary images also set the PC to their entry point and provide
+        a symbol table. A text file's debug map (see debugmap.py) is read from
+        beside it.
         """
-        if len(sys.argv) != 2:
-            print('Invalid number of args')
-            sys.exit(1)
-        
-        try:
-            with open(f'examples/{sys.argv[1]}') as f:
-                address = 0
-                for line in f:
-                    line = line.strip()
-                    if line == '' or line[0] == "#":
-                        continue
-                    num = line.split('#')[0].strip()
-                    try:
-                        instruction = int(num, 2)
-                        self.ram[address] = instruction
-                        address += 1
-                    except:
-                        print("Can't convert string to number")
-                        continue
-        except:
-            print(f"Could not find file named: {sys.argv[1]}")
-            sys.exit(1)
-
-
-    def alu(self, op, reg_a, reg_b):
-        """ALU operations."""
-
-        if op == "ADD":
-            self.reg[reg_a] += self.reg[reg_b]
-            
-        elif op == 'MUL':
-            self.reg[reg_a] *= self.reg[reg_b]
-
-        elif op == "CMP":
-            if self.reg[reg_a] == self.reg[reg_b]:
-                self.fl = 0b00000001
-               
-            elif self.reg[reg_a] > self.reg[reg_b]:
-                self.fl = 0b00000010
-
-            elif self.reg[reg_a] < self.reg[reg_b]:
-                self.fl = 0b000000100
-        
-        elif op == "SUB":
-            self.reg[reg_a] -= self.reg[reg_b]
+        if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+            binary = is_image(source)
+        else:
+            binary = is_image_file(source)
+            if not binary and not isinstance(source, io.TextIOBase):
+                #Text read through a binary file object.
+                source = source.read().decode("utf-8").splitlines()
+
+        if binary:
+            loaded = read_image(source, self.ram)
+            self.pc = loaded.entry
+            self.symbols = loaded.symbols
+            self.debug_info = loaded.debug
+        else:
+            read_text(source, self.ram)
+            self.symbols = {}
+            self.debug_info = read_map(source)
 
-        elif op == "DIV":
-            self.reg[reg_a] /= self.reg[reg_b]
-        
-        elif op == "OR":
-            self.reg[reg_a] = self.reg[reg_a] | self.reg[reg_b]
-        
-        elif op == "XOR":
-            self.reg[reg_a] = self.reg[reg_a] ^ self.reg[reg_b]
-        
-        elif op == "NOT":
-            self.reg[reg_a] = ~self.reg[reg_a]
-        
-        elif op == "SHL":
-            self.reg[reg_a] = self.reg[reg_a] << self.reg[reg_b]
-        
-        elif op == "SHR":
-            self.reg[reg_a] = self.reg[reg_a] >> self.reg[reg_b]
-        
-        elif op == "MOD":
-            self.reg[reg_a] = self.reg[reg_a] % self.reg[reg_b]
-        
-        elif op == "AND":
-            self.reg[reg_a] = self.reg[reg_a] & self.reg[reg_b]
+        self.decoded = [None] * len(self.ram)
+        if self.blocks is not None:
+            self.blocks.clear()
 
-        elif op == "ADDI":
-            self.reg[reg_a] += reg_b
 
-        else:
-            raise Exception("Unsupported ALU operation")
+    def snapshot(self):
+        """The whole machine state as bytes, for restore() (see snapshot.py)."""
+        return snapshot.take(self)
 
-    def push_val(self, val):
-        self.reg[SP] -= 1
-        self.ram_write(val, self.reg[7])
+    def restore(self, data):
+        """Go back to the state saved by snapshot()."""
+        snapshot.apply(self, data)
 
-    def check_for_timer_int(self):
-        #Check the time to see if a timer interrupt should fire.
-        if self.last_timer_int == None:
-            self.last_timer_int = datetime.now()
-        
-        now = datetime.now()
+    def fork(self):
+        """
+        A new CPU in this one's state, to run on from here independently.
+        The child has its own (default) output sink and no profiler, tracer
+        or keyboard thread; queued keys are copied.
+        """
+        child = CPU()
+        child.restore(self.snapshot())
+        return child
 
-        diff = now - self.last_timer_int
+    def alu(self, op, reg_a, reg_b):
+        """ALU operations, op being the instruction's opcode. Each one is a
+        lookup in a precomputed table (see alu.py), so results wrap around to
+        8 bits.
+        """
+        self.branchtable[op](reg_a, reg_b)
 
-        if diff.seconds >= 1:
-            self.last_timer_int = now
-            self.reg[IS] |= IS_TIMER
+    def divide_by_zero(self):
+        #The spec says to print an error and halt.
+        self.output.flush()
+        print("Error: division by zero.")
+        self.halted = True
 
-    def handle_ints(self):
-        if not self.ie:
+    def check_for_timer_int(self):
+        #Called once the cycle count reaches the timer's deadline.
+        if self.timer.poll(self.cycles):
+            self.intc.request(0)
+        self.output.tick()
+
+    def check_spin(self, target, pc):
+        #Called on a backward jump from pc while an interrupt could arrive.
+        #Raises Idle if the CPU will do nothing but loop until it does: the
+        #jump goes to itself, or it closes a short loop that only changes
+        #registers and found them the same as last time around.
+        if target == pc:
+            raise Idle
+        if pc - target > MAX_SPIN_LOOP:
             return
-        
-        masked_interrupts = self.reg[IM] & self.reg[IS]
-        #print(self.ram[248])
-        for i in range(8):
-            if masked_interrupts & (1 << i ):
-                self.ie = 0
-                self.reg[IS] &= ~(1 << i)
-
-                self.push_val(self.pc)
-                self.push_val(self.fl)
-                for r in range(7):
-                    self.push_val(self.reg[r])
-                self.pc = self.ram_read(0xf8 + i)
-                self.operand_a
-                self.operand_b
-                print(self.pc)
-                break
+        state = (target, pc, self.reg.tobytes(), self.fl)
+        if state == self.spin_state and self.is_pure_loop(target, pc):
+            raise Idle
+        self.spin_state = state
+
+    def is_pure_loop(self, start, end):
+        #True if start..end is straight-line code of PURE instructions.
+        address = start
+        while address < end:
+            handler, operand_a, operand_b, size, sets_pc, count = self.decode_one(address)
+            ir = self.ram[address]
+            if ir not in PURE or self.touches_interrupts(ir, operand_a):
+                return False
+            address += size
+        return address == end
+
+    def fast_forward(self, budget):
+        """Skip ahead while the CPU spins waiting for an interrupt.
+        In virtual time that means jumping to the timer's next deadline; in
+        real time it means sleeping until the next tick (or until a device
+        sets wakeup), and counting the time slept at the timer's
+        cycles_per_second. Returns the number of cycles skipped, at most
+        budget.
+        """
+        timer = self.timer
+        slept = 0.0
+        if timer.mode != VIRTUAL:
+            wakeup = self.wakeup
+            if isinstance(wakeup, ExternalWakeup):
+                #Whoever set it up does the sleeping.
+                raise Idle
+            timeout = self.idle_timeout(budget)
+            #Whatever the program printed before going idle (such as the
+            #echo of the last key) shows up now, not after the wait.
+            self.output.flush()
+            start = timer.clock()
+            if wakeup is not None:
+                wakeup.wait(timeout)
+                wakeup.clear()
+            elif timeout is not None:
+                time.sleep(timeout)
+            slept = timer.clock() - start
+        return self.idle_cycles(budget, slept)
+
+    def idle_timeout(self, budget):
+        #How long an idle CPU can sleep in real time: until the next tick if
+        #the timer is unmasked, else until woken (None), but no longer than
+        #the budget takes at the timer's cycles_per_second.
+        timer = self.timer
+        timeout = None
+        if self.reg[IM] & IS_TIMER:
+            timeout = max(0.0, timer.next_tick - timer.clock())
+        if budget is not None:
+            limit = budget / timer.cycles_per_second
+            timeout = limit if timeout is None else min(timeout, limit)
+        return timeout
+
+    def idle_cycles(self, budget, slept):
+        #Cycles to count for an idle stretch of slept seconds: at least up to
+        #the timer's deadline, so it gets polled next.
+        timer = self.timer
+        skip = max(timer.deadline - self.cycles, 0)
+        if timer.mode != VIRTUAL:
+            skip = max(skip, round(slept * timer.cycles_per_second))
+        if budget is not None:
+            skip = min(skip, budget)
+        return skip
 
     def trace(self):
         """
         Handy function to print out the CPU state. You might want to call this
-        from run() if you need help debugging.
+        from run() if you need help debugging. For long runs, attach a
+        tracer.Tracer instead.
         """
 
-        print(f"TRACE: %02X %02X %02X | %02X %02X %02X |" % (
+        print(format_record(
             self.pc,
             self.fl,
             self.ie,
             self.ram_read(self.pc),
             self.ram_read(self.pc + 1),
-            self.ram_read(self.pc + 2)
-        ), end='')
-
-        for i in range(8):
-            print(" %02X" % self.reg[i], end='')
-
-        print()
-
-    def run(self):
-        """Run the CPU."""
-        #prev_time = datetime.now()
-        while self.halted is False: #Presumes activation
-            
-            self.check_for_timer_int()
-            #self.check_for_keyboard_int()
-            self.handle_ints()
-            #self.trace()
-            # new_time = datetime.now()
-            # if (new_time - prev_time).total_seconds() >= 1:
-            #     prev_time = new_time
-            #     self.reg[IS] = self.reg[IS] | 0b00000001
-            
-            # if msvcrt.kbhit():
-            #     self.ram_write(ord(msvcrt.getch()), 0xF4)
-            #     self.reg[IS] = self.reg[IS] | 0b00000010
-            
-            # interrupt_happened = False
-            # if self.ie and self.reg[IM] != 0:
-            #     masked_interrupts = self.reg[IM] & self.reg[IS]
-            #     for i in range(8):
-            #         interrupt_happened = ((masked_interrupts >> i) & 1) == 1
-            #         if interrupt_happened:
-            #             self.interrupts_enabled = False
-            #             self.reg[IS] = self.reg[IS] & (0b11111110 << i)
-            #             self.execute_PUSHI(self.pc)
-            #             self.execute_PUSHI(self.fl)
-
-            #             for j in range(7):
-            #                 self.execute_PUSH
+            self.ram_read(self.pc + 2),
+            self.reg
+        ))
+
+    def run(self, max_cycles=None):
+        """Run the CPU until it halts, or for at most max_cycles instructions.
+        Returns the number of instructions executed; calling it again resumes.
+        """
+        if self.profiler is not None:
+            return self.profiler.run(self, max_cycles)
+        if self.tracer is not None:
+            return self.tracer.run(self, max_cycles)
+        decoded = self.decoded
+        intc = self.intc
+        timer = self.timer
+        if timer.deadline is None:
+            timer.reset(self.cycles)
+        base = self.cycles
+        cycles = 0
+        #Fused records run two instructions, so the budget can be overshot
+        #by one.
+        limit = NO_LIMIT if max_cycles is None else max_cycles
+        #Cycles (counted from this call) until the timer wants a look.
+        next_timer = timer.deadline - base
+        try:
+            while True:
+                try:
+                    while self.halted is False and cycles < limit: #Presumes activation
                         
-            #             self.pc = self.ram[0xF8 + i]
-            #             self.ir = self.ram_read(self.pc)
-
-            #print("instruction 17:", self.ram_read(17))
-            #Collects next instruction
-            self.ir = self.ram_read(self.pc) #Instruction register
-            #print(self.ir)
-            if self.ir in self.branchtable:
-                self.branchtable[self.ir]()
-            else:
-                print(f"Error: Could not find instruction {self.ir} in branchtable.")
-                sys.exit(1)
-            if not self.instruction_sets_pc:
-                self.pc += self.instruction_size
+                        if cycles >= next_timer:
+                            self.cycles = base + cycles
+                            self.check_for_timer_int()
+                            next_timer = timer.deadline - base
+                        if intc.pending:
+                            intc.dispatch()
+
+                        #Collects next instruction from the predecode cache.
+                        pc = self.pc
+                        record = decoded[pc] or self.decode(pc)
+                        handler, operand_a, operand_b, size, sets_pc, count = record
+                        self.ir = self.ram[pc] #Instruction register
+                        cycles += count
+                        handler(operand_a, operand_b)
+                        if not sets_pc:
+                            self.pc += size
+                    break
+                except Idle:
+                    pass
+                except IndexError:
+                    #The predecode cache only covers memory.
+                    if self.pc < len(self.ram):
+                        raise
+                    self.ran_off_end()
+                #Nothing will happen until an interrupt: skip to it. (Outside
+                #the except block, so a Ctrl-C while asleep isn't chained.)
+                self.cycles = base + cycles
+                cycles += self.fast_forward(None if max_cycles is None else limit - cycles)
+        finally:
+            self.cycles = base + cycles
+            self.output.flush()
+        return cycles
+
+    def step(self, n=1):
+        """Run at most n instructions and return how many ran, leaving the
+        CPU ready to step again from where it stopped. With an ExternalWakeup
+        it raises Idle instead of sleeping once it goes idle in real time;
+        cycles then tells how far it got.
+        """
+        return self.run(n)
+
+    async def run_async(self, slice_cycles=10000, max_cycles=None):
+        """Run like run(), but as a coroutine that gives the event loop a turn
+        every slice_cycles instructions, so many CPUs can share one loop.
+        Output sinks with a drain() coroutine are awaited after each slice,
+        and a CPU idling for an interrupt awaits it instead of sleeping.
+        Returns the number of instructions executed.
+        """
+        #Imported here, as it would double the startup time of everything else.
+        import asyncio
+        timer = self.timer
+        wakeup = AsyncWakeup(asyncio.get_running_loop())
+        saved, self.wakeup = self.wakeup, wakeup
+        drain = getattr(self.output, "drain", None)
+        start = self.cycles
+        try:
+            while self.halted is False:
+                budget = slice_cycles
+                if max_cycles is not None:
+                    budget = min(budget, max_cycles - (self.cycles - start))
+                    if budget <= 0:
+                        break
+                before = self.cycles
+                try:
+                    self.run(budget)
+                except Idle:
+                    budget -= self.cycles - before
+                    self.output.flush()
+                    if drain is not None:
+                        await drain()
+                    slept = timer.clock()
+                    try:
+                        await asyncio.wait_for(wakeup.event.wait(), self.idle_timeout(budget))
+                    except asyncio.TimeoutError:
+                        pass
+                    wakeup.clear()
+                    self.cycles += self.idle_cycles(budget, timer.clock() - slept)
+                if drain is not None:
+                    await drain()
+                await asyncio.sleep(0)
+        finally:
+            self.wakeup = saved
+        return self.cycles - start
+
+    def run_blocks(self, max_cycles=None):
+        """Run the CPU a basic block at a time instead of one instruction.
+        max_cycles is checked between blocks, so the last one may overshoot it.
+        """
+        if self.blocks is None:
+            self.blocks = BlockCache(self)
+        blocks = self.blocks
+        timer = self.timer
+        if timer.deadline is None:
+            timer.reset(self.cycles)
+        start = self.cycles
+        limit = None if max_cycles is None else start + max_cycles
+        while self.halted is False and (limit is None or self.cycles < limit):
+
+            #Interrupts are only taken between blocks.
+            if self.cycles >= timer.deadline:
+                self.check_for_timer_int()
+            if self.intc.pending:
+                self.intc.dispatch()
+
+            blocks.stale = False
+            self.cycles += blocks.get(self.pc)(self)
+        self.output.flush()
+        return self.cycles - start
     
     #Branchtable Commands. Might be a way to use the ALU.
-    def execute_HLT(self):
+    #Each one is called with the operands already decoded from ram.
+    def ran_off_end(self):
+        #The PC has run past the end of memory: fail the way fetching from
+        #there always has, as an out of range read and an unknown instruction.
+        self.ir = self.ram_read(self.pc)
+        self.execute_unknown(0, 0)
+
+    def execute_unknown(self, operand_a, operand_b):
+        self.output.flush()
+        print(f"Error: Could not find instruction {self.ir} in branchtable.")
+        sys.exit(1)
+
+    def execute_HLT(self, operand_a, operand_b):
         #Runs the HLT command.
         self.halted = True
+        self.output.flush()
     
-    def execute_LDI(self):
+    def execute_LDI(self, operand_a, operand_b):
         #Write ram command, only targets register.
-        self.reg[self.operand_a] = self.operand_b
+        self.reg[operand_a] = operand_b
 
-    def execute_PRN(self):
+    def execute_PRN(self, operand_a, operand_b):
         #Prints item from register.
-        print(self.reg[self.operand_a])
+        self.output.write(f"{self.reg[operand_a]}\n")
     
-    def execute_MUL(self):
-        #Multiplies the operand_a and operand_b values.
-        #self.reg[self.operand_a] *= self.reg[self.operand_b]
-        self.alu("MUL", self.operand_a, self.operand_b)
+    #Multiplies the operand_a and operand_b values.
+    execute_MUL = alu_instruction("MUL", MUL)
     
-    def execute_PUSH(self):
+    def execute_PUSH(self, operand_a, operand_b):
         #Takes something from the register and moves it to ram.
         #Stack pointer becomes the address.
-        self.sp -= 1
-        self.mdr = self.reg[self.operand_a]
-        self.ram_write(self.sp, self.mdr)
-
-    def execute_PUSHI(self, value):
-        self.sp -= 1
-        self.ram_write(value, self.reg[SP])
+        self.reg[SP] = (self.reg[SP] - 1) & 0xFF
+        self.mdr = self.reg[operand_a]
+        self.ram_write(self.reg[SP], self.mdr)
 
-    def execute_POP(self):
+    def execute_POP(self, operand_a, operand_b):
         #Changes item in register from ram value.
         #Stack pointer is ram address.
-        self.mdr = self.ram_read(self.sp)
-        self.reg[self.operand_a] = self.mdr 
-        self.sp += 1
+        self.mdr = self.ram_read(self.reg[SP])
+        self.reg[operand_a] = self.mdr 
+        self.reg[SP] = (self.reg[SP] + 1) & 0xFF
 
-    def execute_POPI(self):
-        #Pops value at the top of the stack and returns it directly.
-        self.reg[SP] +=1
-        return self.ram_read(self.reg[SP] -1)
-
-    def execute_ST(self):
+    def execute_ST(self, operand_a, operand_b):
         #Stores value in registerb in the address stored in registera
-        self.ram[self.reg[self.operand_a]] = self.reg[self.operand_b]
+        self.ram_write(self.reg[operand_a], self.reg[operand_b])
+
+    def execute_LD(self, operand_a, operand_b):
+        #Loads registera with the value at the address stored in registerb
+        self.reg[operand_a] = self.ram_read(self.reg[operand_b])
 
-    def execute_CALL(self):
+    def execute_CALL(self, operand_a, operand_b):
         #Writes item to ram from stack pointer value. Program counter + instruction_size is value.
         #Iterates the program counter by the value at register operand_a
-        self.sp -= 1
-        self.ram_write(self.sp, self.pc + self.instruction_size)
-        self.pc = self.reg[self.operand_a]
+        self.reg[SP] = (self.reg[SP] - 1) & 0xFF
+        self.ram_write(self.reg[SP], self.pc + 2)
+        self.pc = self.reg[operand_a]
 
-    def execute_RET(self):
+    def execute_RET(self, operand_a, operand_b):
         #Sets program counter to ram value at stack counter address.
-        self.pc = self.ram_read(self.sp)
-        self.sp += 1
+        self.pc = self.ram_read(self.reg[SP])
+        self.reg[SP] = (self.reg[SP] + 1) & 0xFF
 
-    def execute_ADD(self):
-        #Adds operand_a and operand_b together.
-        #self.reg[self.operand_a] += self.reg[self.operand_b]
-        self.alu("ADD", self.operand_a, self.operand_b)
+    #Adds operand_a and operand_b together.
+    execute_ADD = alu_instruction("ADD", ADD)
 
-    def execute_SUB(self):
-        #Subracts operand_b from operand_a
-        self.alu("SUB", self.operand_a, self.operand_b)
+    #Subracts operand_b from operand_a
+    execute_SUB = alu_instruction("SUB", SUB)
 
-    def execute_DIV(self):
-        #Divides operand_a by operand_b
-        self.alu("DIV", self.operand_a, self.operand_b)
+    #Divides operand_a by operand_b
+    execute_DIV = alu_division("DIV", DIV)
     
-    def execute_MOD(self):
-        #Takes the modular of operand_a by operand_b
-        self.alu("MOD", self.operand_a, self.operand_b)
+    #Takes the modular of operand_a by operand_b
+    execute_MOD = alu_division("MOD", MOD)
 
-    def execute_OR(self):
-        #Performs OR function on operand_a by operand_b
-        self.alu("OR", self.operand_a, self.operand_b)
+    #Performs OR function on operand_a by operand_b
+    execute_OR = alu_instruction("OR", OR)
 
-    def execute_XOR(self):
-        #Takes the modular of operand_a by operand_b
-        self.alu("XOR", self.operand_a, self.operand_b)
+    #Exclusive-ors operand_a with operand_b
+    execute_XOR = alu_instruction("XOR", XOR)
 
-    def execute_NOT(self):
-        #Takes the modular of operand_a by operand_b
-        self.alu("NOT", self.operand_a, self.operand_b)
+    def execute_NOT(self, operand_a, operand_b):
+        #Flips every bit of operand_a
+        reg = self.reg
+        reg[operand_a] = NOT_TABLE[reg[operand_a]]
 
-    def execute_SHL(self):
-        #Takes the modular of operand_a by operand_b
-        self.alu("SHL", self.operand_a, self.operand_b)
+    #Shifts operand_a left by operand_b bits
+    execute_SHL = alu_instruction("SHL", SHL)
 
-    def execute_SHR(self):
-        #Takes the modular of operand_a by operand_b
-        self.alu("SHR", self.operand_a, self.operand_b)
+    #Shifts operand_a right by operand_b bits
+    execute_SHR = alu_instruction("SHR", SHR)
 
-    def execute_ADDI(self):
+    def execute_ADDI(self, operand_a, operand_b):
         #Increases the contents of the given register by the given value.
-        self.alu("SHR", self.operand_a, self.operand_b)
+        reg = self.reg
+        reg[operand_a] = (ALU_TABLES[0x5] or alu_table(0x5))[reg[operand_a] << 8 | operand_b]
 
-    def execute_AND(self):
-        #Performs and function on operand_a and operand_b
-        self.alu("AND", self.operand_a, self.operand_b)
+    #Performs and function on operand_a and operand_b
+    execute_AND = alu_instruction("AND", AND)
 
-    def execute_JMP(self):
+    def execute_JMP(self, operand_a, operand_b):
         #Causes to program counter to go to the operand_a value in memory.
-        self.pc = self.reg[self.operand_a]
+        pc = self.pc
+        self.pc = target = self.reg[operand_a]
+        if target <= pc and self.ie and self.reg[IM] & self.wakeups:
+            self.check_spin(target, pc)
     
-    def execute_JEQ(self):
+    def execute_JEQ(self, operand_a, operand_b):
         #If the equal flag is set to true, jump.
         if self.fl == 0b00000001:
-            self.execute_JMP()
+            self.execute_JMP(operand_a, operand_b)
         else:
             self.pc += 2
         
-    def execute_JNE(self):
+    def execute_JNE(self, operand_a, operand_b):
         #If the equal flag isn't true, jump.
         if self.fl != 0b00000001:
-            self.execute_JMP()
+            self.execute_JMP(operand_a, operand_b)
         else:
             self.pc += 2
 
-    def execute_CMP(self):
+    def execute_CMP(self, operand_a, operand_b):
         #Compare two values. Set a flag with answer.
-        self.alu("CMP", self.operand_a, self.operand_b)
+        reg = self.reg
+        self.fl = (ALU_TABLES[0x7] or alu_table(0x7))[reg[operand_a] << 8 | reg[operand_b]]
+
+    #Fused pairs (see fuse_pair). Each runs with the PC at its first
+    #instruction, and moves it on to the second before a jump, as usual.
+
+    def execute_LDI_jump(self, operand_a, operands):
+        value, jump = operands
+        self.reg[operand_a] = value
+        self.pc += 3
+        jump(operand_a, 0)
+
+    def execute_CMP_jump(self, operand_a, operands):
+        reg_b, reg_c, on_equal = operands
+        a = self.reg[operand_a]
+        b = self.reg[reg_b]
+        self.fl = 0b00000001 if a == b else 0b00000010 if a > b else 0b00000100
+        if (a == b) == on_equal:
+            self.pc += 3
+            self.execute_JMP(reg_c, 0)
+        else:
+            self.pc += 5
+
+    def execute_LDI_ADD(self, operand_a, operands):
+        value, reg_y = operands
+        reg = self.reg
+        reg[operand_a] = value
+        reg[reg_y] = (reg[reg_y] + value) & 0xFF
 
-    def execute_IRET(self):
+    def execute_IRET(self, operand_a, operand_b):
         #Returns from interrupt handler.
-        print("IRET")
-        for _ in reversed(range(7)):
-            self.execute_POP()
-        self.fl = self.execute_POPI()
-        self.pc = self.execute_POPI()
-        self.interrupts_enabled = True
-
-    def execute_PRA(self):
+        self.intc.iret()
+
+    def execute_PRA(self, operand_a, operand_b):
         #Print alpha character stored in the given register
-        print(chr(self.reg[self.operand_a]), end='', flush=True)
+        self.output.write(chr(self.reg[operand_a]))
     
-    def execute_AST(self):
-        asts = ''
-        for _ in range(self.reg[self.operand_a]):
-            asts += '*'
-        print(asts)
-
+    def execute_AST(self, operand_a, operand_b):
+        #Prints a row of asterisks as long as the value in the register.
+        self.output.write('*' * self.reg[operand_a] + '\n')
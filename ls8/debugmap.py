@@ -0,0 +1,96 @@
+"""Debug maps: which source line and label each address belongs to."""
+
+#The assembler writes a map with -g (see debug_map in asm/asm.py): into the
+#debug section of a binary image, or next to a text program as
+#<program>.map, which CPU.load picks up. It is JSON:
+#
+#  {"source": "call.asm",
+#   "lines": [[start, end, line], ...],
+#   "labels": [[label, start, end], ...]}
+#
+#where each range covers addresses start up to (not including) end. A
+#program with only a symbol table still gets label ranges, each running to
+#the next label.
+
+import os.path
+from bisect import bisect_right
+
+
+class DebugMap:
+    """Address lookups for one program."""
+
+    def __init__(self, source=None, lines=(), labels=()):
+        self.source = source
+        self.lines = sorted(tuple(line) for line in lines)
+        self.line_starts = [start for start, _, _ in self.lines]
+        #Where several labels share an address, the last one names it.
+        self.labels = sorted(((start, end, name) for name, start, end in labels), key=lambda r: r[0])
+        self.label_starts = [start for start, _, _ in self.labels]
+
+    @classmethod
+    def for_cpu(cls, cpu):
+        """The map for the program loaded in cpu, from its debug info or symbols."""
+        if cpu.debug_info:
+            #Only needed here, so loading a program doesn't import it.
+            import json
+            try:
+                debug = json.loads(bytes(cpu.debug_info))
+            except ValueError:
+                debug = None
+            if isinstance(debug, dict) and ("lines" in debug or "labels" in debug):
+                return cls(debug.get("source"), debug.get("lines", ()), debug.get("labels", ()))
+        return cls.from_symbols(cpu.symbols, len(cpu.ram))
+
+    @classmethod
+    def from_symbols(cls, symbols, size=256):
+        """Label ranges from a symbol table, each running to the next label."""
+        starts = sorted(set(symbols.values()))
+        labels = []
+        for name, start in symbols.items():
+            i = starts.index(start)
+            labels.append((name, start, starts[i + 1] if i + 1 < len(starts) else size))
+        return cls(labels=labels)
+
+    def __bool__(self):
+        return bool(self.lines or self.labels)
+
+    def find(self, starts, ranges, address):
+        i = bisect_right(starts, address) - 1
+        if i >= 0 and address < ranges[i][1]:
+            return ranges[i]
+        return None
+
+    def line(self, address):
+        """The source line number of the statement at address, or None."""
+        found = self.find(self.line_starts, self.lines, address)
+        return None if found is None else found[2]
+
+    def location(self, address):
+        """Where address comes from, as file:line, or None."""
+        line = self.line(address)
+        if line is None:
+            return None
+        return f"{self.source or '?'}:{line}"
+
+    def label(self, address):
+        """(label, offset from it) for address, or None."""
+        found = self.find(self.label_starts, self.labels, address)
+        return None if found is None else (found[2], address - found[0])
+
+    def name(self, address):
+        """address as "LABEL" or "LABEL+n", or in hex outside any label."""
+        found = self.label(address)
+        if found is None:
+            return f"{address:#04x}"
+        label, offset = found
+        return label if offset == 0 else f"{label}+{offset}"
+
+
+def read_map(source):
+    """The map file next to a text program at path source, or b""."""
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        path = os.fsdecode(source) + ".map"
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+    return b""
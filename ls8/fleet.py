@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""Fleet runner: runs many .ls8 programs across a process pool."""
+
+#Each program runs in a worker process with its own CPU, a cycle budget and
+#a wall-clock timeout. Everything it prints is captured, and one report row
+#per run (status, exit code, output, cycles, wall time) is written as JSON
+#or CSV.
+#
+#Example:
+#
+#  python fleet.py -j 8 --max-cycles 1000000 --timeout 5 'examples/*.ls8'
+
+import sys
+import io
+import os
+import csv
+import json
+import glob
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from cpu import *
+
+#Cycles run between timeout checks.
+SLICE = 10000
+
+FIELDS = ["image", "status", "exit_code", "cycles", "wall_time", "output"]
+
+
+def run_image(image, max_cycles=None, timeout=None):
+    """
+    Run one program and return its report row. status is one of "halted",
+    "cycle_limit", "timeout" or "error".
+    """
+
+    start = time.perf_counter()
+    out = io.StringIO()
+    cpu = CPU()
+    status = "halted"
+    exit_code = 0
+
+    try:
+        with contextlib.redirect_stdout(out):
+            cpu.load(image)
+            while cpu.halted is False:
+                budget = SLICE
+                if max_cycles is not None:
+                    budget = min(budget, max_cycles - cpu.cycles)
+                    if budget <= 0:
+                        status = "cycle_limit"
+                        break
+                cpu.run(budget)
+                if timeout is not None and time.perf_counter() - start > timeout:
+                    if cpu.halted is False:
+                        status = "timeout"
+                    break
+    except SystemExit as e:
+        status = "error"
+        exit_code = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        status = "error"
+        exit_code = 1
+        out.write(f"{type(e).__name__}: {e}\n")
+
+    return {
+        "image": image,
+        "status": status,
+        "exit_code": exit_code,
+        "cycles": cpu.cycles,
+        "wall_time": time.perf_counter() - start,
+        "output": out.getvalue(),
+    }
+
+
+def expand_images(patterns):
+    """
+    Expand glob patterns (for shells that didn't) into a sorted list of files.
+    """
+
+    images = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        images.extend(matches if matches else [pattern])
+    return images
+
+
+def run_fleet(images, jobs=None, max_cycles=None, timeout=None):
+    """
+    Run every image across a pool of jobs worker processes and return the
+    report rows in the order the images were given.
+    """
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_image, image, max_cycles, timeout) for image in images]
+        return [f.result() for f in futures]
+
+
+def write_report(rows, outputfile, fmt):
+    if fmt == "csv":
+        writer = csv.DictWriter(outputfile, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        json.dump(rows, outputfile, indent=2)
+        outputfile.write("\n")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("images", nargs="+", help=".ls8 files or glob patterns")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--max-cycles", type=int, default=None,
+                        help="stop each run after this many instructions")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="stop each run after this many seconds")
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("-o", "--output", default="-",
+                        help="report file (default: stdout)")
+    args = parser.parse_args(argv[1:])
+
+    images = expand_images(args.images)
+    rows = run_fleet(images, args.jobs, args.max_cycles, args.timeout)
+
+    if args.output == "-":
+        write_report(rows, sys.stdout, args.format)
+    else:
+        with open(args.output, "w", newline="") as f:
+            write_report(rows, f, args.format)
+
+    failed = [r for r in rows if r["status"] != "halted"]
+    print(f"{len(rows)} runs, {len(failed)} not halted", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,162 @@
+"""Binary LS-8 program images."""
+
+#An image is a small header followed by the raw program bytes and two
+#optional sections:
+#
+#  offset  size  field
+#  0       4     magic, b"LS8\x00"
+#  4       1     format version (1)
+#  5       1     entry point: the initial PC
+#  6       2     code length (little endian, at most 256)
+#  8       2     symbols section length
+#  10      2     debug section length
+#  12      ...   code, then symbols, then debug
+#
+#The symbols section is a run of (address: 1 byte, name length: 1 byte,
+#name: UTF-8) entries. The debug section is UTF-8 JSON whose contents are
+#up to the tools that write and read it.
+
+import io
+import mmap
+import struct
+
+MAGIC = b"LS8\x00"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHHH")
+
+
+class Image:
+    """What a binary image carries besides the code itself."""
+
+    def __init__(self, entry=0, symbols=None, debug=b""):
+        self.entry = entry
+        self.symbols = symbols if symbols is not None else {}
+        self.debug = debug
+
+
+def is_image(path):
+    """True if the file at path starts with the image magic."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def pack_symbols(symbols):
+    out = bytearray()
+    for name, address in symbols.items():
+        encoded = name.encode("utf-8")
+        out += bytes((address & 0xFF, len(encoded))) + encoded
+    return bytes(out)
+
+
+def unpack_symbols(data):
+    symbols = {}
+    i = 0
+    while i < len(data):
+        address, length = data[i], data[i + 1]
+        symbols[bytes(data[i + 2:i + 2 + length]).decode("utf-8")] = address
+        i += 2 + length
+    return symbols
+
+
+def write_image(f, code, entry=0, symbols=None, debug=b""):
+    """Write code (bytes) and its sections to the binary file object f."""
+    if len(code) > 256:
+        raise ValueError(f"program is {len(code)} bytes, the LS-8 only has 256")
+    sym = pack_symbols(symbols or {})
+    f.write(HEADER.pack(MAGIC, VERSION, entry, len(code), len(sym), len(debug)))
+    f.write(code)
+    f.write(sym)
+    f.write(debug)
+
+
+def parse_header(header):
+    magic, version, entry, code_len, sym_len, debug_len = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("not an LS-8 image")
+    if version != VERSION:
+        raise ValueError(f"unsupported LS-8 image version {version}")
+    if code_len > 256:
+        raise ValueError("LS-8 image code section is larger than memory")
+    return entry, code_len, sym_len, debug_len
+
+
+def read_image(source, ram):
+    """
+    Load an image from a path or binary file object into ram and return its
+    Image. Paths are mapped with mmap; file objects are read with readinto,
+    straight into ram when it's a bytearray.
+    """
+
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if len(mm) < HEADER.size:
+                raise ValueError("LS-8 image is truncated")
+            entry, code_len, sym_len, debug_len = parse_header(mm[:HEADER.size])
+            if HEADER.size + code_len + sym_len + debug_len > len(mm):
+                raise ValueError("LS-8 image is truncated")
+            start = HEADER.size
+            ram[:code_len] = mm[start:start + code_len]
+            start += code_len
+            symbols = unpack_symbols(mm[start:start + sym_len])
+            start += sym_len
+            debug = mm[start:start + debug_len]
+        return Image(entry, symbols, debug)
+
+    entry, code_len, sym_len, debug_len = parse_header(read_exactly(source, HEADER.size))
+    if isinstance(ram, bytearray):
+        view = memoryview(ram)[:code_len]
+        if source.readinto(view) != code_len:
+            raise ValueError("LS-8 image is truncated")
+    else:
+        ram[:code_len] = read_exactly(source, code_len)
+    symbols = unpack_symbols(read_exactly(source, sym_len))
+    debug = read_exactly(source, debug_len)
+    return Image(entry, symbols, debug)
+
+
+def read_exactly(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError("LS-8 image is truncated")
+    return data
+
+
+def read_text(source, ram):
+    """
+    Load a text .ls8 program (one binary byte per line, # comments) from a
+    path or text file object into ram. Returns the number of bytes loaded.
+    """
+
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source) as f:
+            return read_text(f, ram)
+
+    address = 0
+    for line in source:
+        num = line.split('#', 1)[0].strip()
+        if num == '':
+            continue
+        try:
+            ram[address] = int(num, 2)
+        except ValueError:
+            print(f"Can't convert string to number: {num}")
+            continue
+        address += 1
+    return address
+
+
+def is_image_file(f):
+    """
+    True if the file object f starts with the image magic, which is left
+    unread. Text file objects never hold an image.
+    """
+
+    if isinstance(f, io.TextIOBase):
+        return False
+    if hasattr(f, "peek"):
+        head = f.peek(len(MAGIC))
+    else:
+        position = f.tell()
+        head = f.read(len(MAGIC))
+        f.seek(position)
+    return head[:len(MAGIC)] == MAGIC
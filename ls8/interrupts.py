@@ -0,0 +1,101 @@
+"""Interrupt controller for the LS-8."""
+
+#Rather than looking at IM and IS before every instruction, the controller
+#keeps a single pending value (IM & IS while interrupts are enabled, else 0)
+#and recomputes it only when IM, IS or ie change. The run loop just tests
+#that value; dispatch finds the lowest pending interrupt with a bit trick and
+#saves the whole register file with one slice copy.
+#
+#Devices running in other threads (the keyboard) raise interrupts too, so
+#changes to IS and pending are made under a lock. A device can also hook the
+#moment its interrupt is taken, to latch data for the handler.
+
+import threading
+from array import array
+
+IM = 5
+IS = 6
+SP = 7
+
+#Stack frame pushed on an interrupt: PC, FL, then R0-R6, so from the lowest
+#address up it holds R6..R0, FL, PC.
+FRAME_SIZE = 9
+
+VECTOR_TABLE = 0xF8
+
+
+class Idle(Exception):
+    """Raised by a jump that leaves the CPU spinning until an interrupt."""
+
+
+class InterruptController:
+    """Tracks pending interrupts for one CPU and enters/leaves handlers."""
+
+    __slots__ = ('cpu', 'pending', 'lock', 'acknowledge')
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.pending = 0
+        self.lock = threading.Lock()
+        #Interrupt number -> function called when that interrupt is taken.
+        self.acknowledge = {}
+
+    def update(self):
+        """Recompute pending. Call after IM, IS or ie change."""
+        cpu = self.cpu
+        with self.lock:
+            self.pending = cpu.reg[IM] & cpu.reg[IS] if cpu.ie else 0
+
+    def request(self, n):
+        """Raise interrupt n: set its bit in IS. Safe from any thread."""
+        cpu = self.cpu
+        with self.lock:
+            cpu.reg[IS] |= 1 << n
+            self.pending = cpu.reg[IM] & cpu.reg[IS] if cpu.ie else 0
+
+    def dispatch(self):
+        """Enter the handler of the lowest numbered pending interrupt."""
+        cpu = self.cpu
+        reg = cpu.reg
+        pending = self.pending
+        n = (pending & -pending).bit_length() - 1
+
+        with self.lock:
+            cpu.ie = 0
+            reg[IS] &= ~(1 << n) & 0xFF
+            self.pending = 0
+        acknowledge = self.acknowledge.get(n)
+        if acknowledge is not None:
+            acknowledge()
+
+        sp = reg[SP]
+        frame = (sp - FRAME_SIZE) & 0xFF
+        data = reg[6::-1].tobytes() + bytes((cpu.fl, cpu.pc))
+        if frame < sp:
+            cpu.ram[frame:sp] = data
+            cpu.invalidate_range(frame, sp)
+        else:
+            #The frame wraps around the bottom of memory, as PUSH does.
+            for i, value in enumerate(data):
+                address = (frame + i) & 0xFF
+                cpu.ram[address] = value
+                cpu.invalidate(address)
+        reg[SP] = frame
+        cpu.pc = cpu.ram[VECTOR_TABLE + n]
+
+    def iret(self):
+        """Leave a handler: restore the frame pushed by dispatch."""
+        cpu = self.cpu
+        reg = cpu.reg
+        sp = reg[SP]
+        if sp + FRAME_SIZE <= len(cpu.ram):
+            frame = cpu.ram[sp:sp + FRAME_SIZE]
+        else:
+            #The frame wraps around the top of memory, as POP does.
+            frame = bytes(cpu.ram[(sp + i) & 0xFF] for i in range(FRAME_SIZE))
+        reg[0:7] = array('B', frame[6::-1])
+        cpu.fl = frame[7]
+        cpu.pc = frame[8]
+        reg[SP] = (sp + FRAME_SIZE) & 0xFF
+        cpu.ie = 1
+        self.update()
@@ -0,0 +1,124 @@
+"""Keyboard device for the LS-8: raises interrupt 1 for each key."""
+
+#Keys come from a queue. They get there from a background thread reading a
+#file descriptor (stdin, a pipe or a pty), from an asyncio reader on one
+#(for CPU.run_async), or from feed(), which scripts input for tests and runs
+#at full speed. The run loop never reads
+#input itself: a new key just raises the interrupt, which the run loop
+#already checks for through the interrupt controller's pending value.
+#
+#The key is written to KEY_ADDRESS when the CPU takes the interrupt, not when
+#it arrives, so keys typed faster than the handler runs are queued instead of
+#overwriting each other. If more keys are waiting, the interrupt is raised
+#again for the next one.
+
+import os
+import sys
+import threading
+from collections import deque
+
+from cpu import IS_KEYBOARD
+
+#Where the most recent key is stored.
+KEY_ADDRESS = 0xF4
+
+KEYBOARD_INTERRUPT = 1
+
+
+class Keyboard:
+    """Queue of keys for one CPU."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.keys = deque()
+        cpu.keyboard = self
+        self.thread = None
+        self.stream = None
+        self.fd = None
+        self.loop = None
+        self.saved_mode = None
+        cpu.intc.acknowledge[KEYBOARD_INTERRUPT] = self.acknowledge
+        #Let a CPU spinning in wait for keys sleep until one comes in.
+        cpu.wakeups |= IS_KEYBOARD
+        if cpu.wakeup is None:
+            cpu.wakeup = threading.Event()
+
+    def feed(self, data):
+        """Queue keys. data is a str or bytes; each byte is one key."""
+        if isinstance(data, str):
+            data = data.encode()
+        if not data:
+            return
+        self.keys.extend(data)
+        self.cpu.intc.request(KEYBOARD_INTERRUPT)
+        self.cpu.wakeup.set()
+
+    def acknowledge(self):
+        #Called by the interrupt controller as the CPU takes the interrupt.
+        keys = self.keys
+        if not keys:
+            return
+        cpu = self.cpu
+        cpu.ram[KEY_ADDRESS] = keys.popleft()
+        cpu.invalidate(KEY_ADDRESS)
+        if keys:
+            cpu.intc.request(KEYBOARD_INTERRUPT)
+
+    def start(self, stream=None):
+        """
+        Start a background thread feeding keys read from stream (stdin by
+        default). A terminal is switched to cbreak mode, so keys arrive as
+        they are typed, until stop() is called.
+        """
+
+        self.open(stream)
+        self.thread = threading.Thread(target=self.read_loop, name="ls8-keyboard", daemon=True)
+        self.thread.start()
+
+    def start_async(self, stream=None):
+        """Like start(), but reads from the running asyncio loop, no thread."""
+        import asyncio
+        self.open(stream)
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.fd, self.read_ready)
+
+    def open(self, stream):
+        #Kept so the file isn't closed under the reader.
+        self.stream = stream if stream is not None else sys.stdin
+        self.fd = self.stream.fileno()
+        if os.isatty(self.fd):
+            import termios
+            import tty
+            self.saved_mode = termios.tcgetattr(self.fd)
+            tty.setcbreak(self.fd)
+
+    def read_ready(self):
+        try:
+            data = os.read(self.fd, 64)
+        except OSError:
+            data = b""
+        if data:
+            self.feed(data)
+        else:
+            self.loop.remove_reader(self.fd)
+            self.loop = None
+
+    def read_loop(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64)
+            except OSError:
+                return
+            if not data:
+                return
+            self.feed(data)
+
+    def stop(self):
+        """Stop an asyncio reader and put the terminal back as it was."""
+        if self.loop is not None:
+            self.loop.remove_reader(self.fd)
+            self.loop = None
+        if self.saved_mode is not None:
+            import termios
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved_mode)
+            self.saved_mode = None
@@ -3,9 +3,34 @@
 """Main."""
 
 import sys
+import os.path
 from cpu import *
+from keyboard import Keyboard
+
+if len(sys.argv) != 2:
+    print('Invalid number of args')
+    sys.exit(1)
+
+#Programs can be named by path, or by file name inside examples/.
+program = sys.argv[1]
+if not os.path.exists(program):
+    program = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples', program)
 
 cpu = CPU()
 
-cpu.load()
-cpu.run()
\ No newline at end of file
+try:
+    cpu.load(program)
+except OSError:
+    print(f"Could not find file named: {sys.argv[1]}")
+    sys.exit(1)
+except ValueError as e:
+    print(f"Could not load {sys.argv[1]}: {e}")
+    sys.exit(1)
+
+#Keys typed (or piped in) raise the keyboard interrupt.
+keyboard = Keyboard(cpu)
+keyboard.start()
+try:
+    cpu.run()
+finally:
+    keyboard.stop()
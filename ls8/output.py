@@ -0,0 +1,103 @@
+"""Output devices for PRN, PRA and AST."""
+
+#The CPU writes text to its output sink instead of printing directly.
+#
+#* BufferedOutput collects writes and passes them to a stream in one go: when
+#  the buffer reaches a size threshold, when a write comes in after the flush
+#  interval has passed, on the CPU's timer checks, and on HLT.
+#* CaptureOutput keeps everything in memory, for embedding and tests.
+#* NullOutput throws everything away, for benchmarking.
+#* StreamOutput writes to an asyncio StreamWriter; CPU.run_async awaits its
+#  drain() between slices so a slow reader holds up only its own CPU.
+
+import sys
+import time
+
+
+class BufferedOutput:
+    """Buffers output and writes it to a stream (stdout by default)."""
+
+    __slots__ = ('stream', 'threshold', 'interval', 'clock', 'buffer', 'size', 'last_flush')
+
+    def __init__(self, stream=None, threshold=4096, interval=0.1, clock=time.monotonic):
+        self.stream = stream
+        self.threshold = threshold
+        self.interval = interval
+        self.clock = clock
+        self.buffer = []
+        self.size = 0
+        self.last_flush = clock()
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.threshold or self.clock() - self.last_flush >= self.interval:
+            self.flush()
+
+    def tick(self):
+        #Flushes output that has been sitting around for a full interval.
+        if self.buffer and self.clock() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = self.clock()
+        if not self.buffer:
+            return
+        #Looked up now, so redirecting sys.stdout works as it does for print.
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write("".join(self.buffer))
+        stream.flush()
+        self.buffer = []
+        self.size = 0
+
+
+class CaptureOutput:
+    """Keeps all output in memory."""
+
+    def __init__(self):
+        self.buffer = []
+
+    def write(self, text):
+        self.buffer.append(text)
+
+    def tick(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self.buffer)
+
+
+class NullOutput:
+    """Discards all output."""
+
+    def write(self, text):
+        pass
+
+    def tick(self):
+        pass
+
+    def flush(self):
+        pass
+
+
+class StreamOutput:
+    """Writes to an asyncio StreamWriter (a socket or pipe)."""
+
+    def __init__(self, writer, encoding="utf-8"):
+        self.writer = writer
+        self.encoding = encoding
+
+    def write(self, text):
+        self.writer.write(text.encode(self.encoding))
+
+    def tick(self):
+        pass
+
+    def flush(self):
+        pass
+
+    async def drain(self):
+        await self.writer.drain()
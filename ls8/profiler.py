@@ -0,0 +1,174 @@
+"""Execution profiler for the LS-8 CPU."""
+
+#Attaching a Profiler to a CPU (cpu.profiler = Profiler()) makes CPU.run hand
+#over to the profiler's own copy of the run loop, so an unprofiled CPU runs
+#exactly the same loop as before and pays nothing.
+#
+#* Exact mode (the default) counts every instruction by opcode and by PC and
+#  times every execute_* handler call.
+#* Sampling mode (sample_every=N) does the same for every Nth instruction
+#  only and scales the results up by N, which is cheap enough to leave on.
+#
+#Both modes follow CALL/RET and interrupts/IRET to keep a call stack, and
+#record it with each counted instruction for flame graphs.
+#
+#If the program came with a debug map or symbol table (see debugmap.py),
+#stack frames are named by label, and the report also totals instructions
+#by label and by source line.
+
+import json
+import time
+from collections import Counter
+
+from cpu import CALL, RET, IRET
+from debugmap import DebugMap
+from interrupts import Idle
+
+
+class Profiler:
+    """Counts and times instructions run by a CPU."""
+
+    def __init__(self, sample_every=None):
+        self.sample_every = sample_every
+        #Instructions until the next sample.
+        self.countdown = 1
+        self.cycles = 0
+        self.samples = 0
+        self.opcodes = Counter()
+        self.pcs = Counter()
+        self.handler_time = Counter()
+        self.stacks = Counter()
+        #Addresses of the routines currently being run, outermost first.
+        self.stack = []
+        #DebugMap of the program, taken from the CPU on the first run.
+        self.debug = None
+
+    @property
+    def scale(self):
+        #How many instructions each recorded one stands for.
+        return self.sample_every or 1
+
+    def run(self, cpu, max_cycles=None):
+        """CPU.run with profiling. Returns the number of instructions executed."""
+        if cpu.fuse:
+            cpu.unfuse()
+        if self.debug is None:
+            self.debug = DebugMap.for_cpu(cpu)
+        decoded = cpu.decoded
+        intc = cpu.intc
+        timer = cpu.timer
+        if timer.deadline is None:
+            timer.reset(cpu.cycles)
+        base = cpu.cycles
+        cycles = 0
+        limit = -1 if max_cycles is None else max_cycles
+        next_timer = timer.deadline - base
+        every = self.scale
+        countdown = self.countdown
+        stack = self.stack
+        clock = time.perf_counter
+        try:
+            while True:
+                try:
+                    while cpu.halted is False and cycles != limit:
+
+                        if cycles >= next_timer:
+                            cpu.cycles = base + cycles
+                            cpu.check_for_timer_int()
+                            next_timer = timer.deadline - base
+                        if intc.pending:
+                            intc.dispatch()
+                            stack.append(cpu.pc)
+
+                        pc = cpu.pc
+                        record = decoded[pc] or cpu.decode(pc)
+                        handler, operand_a, operand_b, size, sets_pc, count = record
+                        ir = cpu.ir = cpu.ram[pc]
+                        cycles += 1
+                        countdown -= 1
+                        if countdown:
+                            handler(operand_a, operand_b)
+                        else:
+                            countdown = every
+                            start = clock()
+                            handler(operand_a, operand_b)
+                            elapsed = clock() - start
+                            name = handler.__name__[len("execute_"):]
+                            self.samples += 1
+                            self.opcodes[name] += 1
+                            self.pcs[pc] += 1
+                            self.handler_time[name] += elapsed
+                            self.stacks[tuple(stack)] += 1
+
+                        if not sets_pc:
+                            cpu.pc += size
+                        elif ir == CALL:
+                            stack.append(cpu.pc)
+                        elif (ir == RET or ir == IRET) and stack:
+                            stack.pop()
+                    break
+                except Idle:
+                    pass
+                except IndexError:
+                    if cpu.pc < len(cpu.ram):
+                        raise
+                    cpu.ran_off_end()
+                cpu.cycles = base + cycles
+                cycles += cpu.fast_forward(None if limit < 0 else limit - cycles)
+        finally:
+            cpu.cycles = base + cycles
+            self.cycles += cycles
+            self.countdown = countdown
+            cpu.output.flush()
+        return cycles
+
+    def frame_name(self, address):
+        if self.debug:
+            return self.debug.name(address)
+        return f"{address:#04x}"
+
+    def by_label(self):
+        """Instructions counted per label; code before the first label is "main"."""
+        counts = Counter()
+        for pc, n in self.pcs.items():
+            found = self.debug.label(pc)
+            counts["main" if found is None else found[0]] += n
+        return counts
+
+    def by_line(self):
+        """Instructions counted per source line, as "file:line"."""
+        counts = Counter()
+        for pc, n in self.pcs.items():
+            location = self.debug.location(pc)
+            if location is not None:
+                counts[location] += n
+        return counts
+
+    def report(self):
+        """The profile as a dict. Sampled counts and times are scaled up."""
+        scale = self.scale
+        report = {
+            "mode": "exact" if self.sample_every is None else "sampling",
+            "sample_every": scale,
+            "cycles": self.cycles,
+            "samples": self.samples,
+            "opcodes": {name: n * scale for name, n in self.opcodes.most_common()},
+            "pcs": {f"{pc:#04x}": n * scale for pc, n in sorted(self.pcs.items())},
+            "handler_time": {name: t * scale for name, t in self.handler_time.most_common()},
+        }
+        if self.debug:
+            report["labels"] = {name: n * scale for name, n in self.by_label().most_common()}
+            report["lines"] = {where: n * scale for where, n in self.by_line().most_common()}
+        return report
+
+    def write_json(self, f):
+        json.dump(self.report(), f, indent=2)
+        f.write("\n")
+
+    def collapsed(self):
+        """The call stacks in collapsed format, one "a;b;c count" per line."""
+        lines = []
+        for stack, n in self.stacks.most_common():
+            frames = ["main"] + [self.frame_name(address) for address in stack]
+            lines.append(f"{';'.join(frames)} {n * self.scale}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+"""Scheduler: runs many CPUs in one process, a slice at a time."""
+
+#Each turn steps one machine for at most its quota of cycles, round-robin by
+#default or highest priority first. Machines belong to tenants, and once a
+#tenant with a cycle budget has used it up its machines are parked until
+#set_budget gives it more.
+#
+#Machines that halt or fail leave the scheduler. Machines that go idle
+#waiting for an interrupt (in real time) are parked instead of being
+#stepped: until their next timer tick, or until a device such as a Keyboard
+#wakes them. Machines are only stepped by the thread calling run(); devices
+#can wake them from any thread.
+#
+#Everything a machine prints, including error messages, is captured in its
+#console. Example:
+#
+#  python scheduler.py --quota 1000 --budget 1000000 'examples/*.ls8'
+
+import io
+import sys
+import time
+import heapq
+import argparse
+import threading
+import contextlib
+from collections import deque
+
+from cpu import *
+from fleet import expand_images, write_report
+
+ROUND_ROBIN = "round-robin"
+PRIORITY = "priority"
+
+#Machine states.
+READY = "ready"
+IDLE = "idle"
+OVER_BUDGET = "over_budget"
+HALTED = "halted"
+FAILED = "failed"
+
+
+class Tenant:
+    """Owner of machines, with an optional budget of cycles."""
+
+    def __init__(self, name, budget=None):
+        self.name = name
+        self.budget = budget
+        self.used = 0
+        #Machines waiting for more budget.
+        self.parked = []
+
+    @property
+    def remaining(self):
+        return None if self.budget is None else max(self.budget - self.used, 0)
+
+
+class Machine:
+    """A CPU run by a Scheduler."""
+
+    __slots__ = ('cpu', 'name', 'tenant', 'priority', 'quota', 'state', 'exit_code',
+                 'console', 'cycles', 'parked_at')
+
+    def __init__(self, cpu, name, tenant, priority, quota):
+        self.cpu = cpu
+        self.name = name
+        self.tenant = tenant
+        self.priority = priority
+        self.quota = quota
+        self.state = READY
+        self.exit_code = 0
+        self.console = io.StringIO()
+        #Cycles run on this machine's behalf; idle time isn't counted.
+        self.cycles = 0
+        #When it went idle.
+        self.parked_at = None
+
+
+class Scheduler:
+    """Steps many CPUs in turn from one thread."""
+
+    def __init__(self, quota=1000, policy=ROUND_ROBIN, on_exit=None, clock=time.monotonic):
+        if policy not in (ROUND_ROBIN, PRIORITY):
+            raise ValueError(f"unknown scheduling policy: {policy}")
+        self.quota = quota
+        self.policy = policy
+        #Called with each machine that halts or fails.
+        self.on_exit = on_exit
+        self.clock = clock
+        self.tenants = {}
+        #Heap of (key, sequence, machine); the sequence keeps equal keys in
+        #first-in, first-out order, which is round-robin.
+        self.ready = []
+        #Heap of (wake time, sequence, machine) for idle machines with a
+        #timer tick coming.
+        self.sleeping = []
+        #Machines woken by devices, and the event that tells run() about it.
+        self.woken = deque()
+        self.event = threading.Event()
+        self.sequence = 0
+        self.active = 0
+
+    def tenant(self, name):
+        """The tenant called name, created with no budget if it's new."""
+        tenant = self.tenants.get(name)
+        if tenant is None:
+            tenant = self.tenants[name] = Tenant(name)
+        return tenant
+
+    def set_budget(self, name, budget):
+        """Set a tenant's total cycle budget (None: unlimited)."""
+        tenant = self.tenant(name)
+        tenant.budget = budget
+        if tenant.remaining != 0:
+            parked, tenant.parked = tenant.parked, []
+            for machine in parked:
+                self.push(machine)
+
+    def add(self, cpu, name=None, tenant="default", priority=0, quota=None):
+        """Schedule cpu and return its Machine. Higher priorities run first."""
+        machine = Machine(cpu, name, self.tenant(tenant), priority,
+                          self.quota if quota is None else quota)
+        #An idle CPU stops and waits here instead of sleeping in step().
+        cpu.wakeup = ExternalWakeup(lambda: self.wake(machine))
+        self.active += 1
+        self.push(machine)
+        return machine
+
+    def push(self, machine):
+        machine.state = READY
+        key = -machine.priority if self.policy == PRIORITY else 0
+        self.sequence += 1
+        heapq.heappush(self.ready, (key, self.sequence, machine))
+
+    def wake(self, machine):
+        #Called by devices, from any thread.
+        self.woken.append(machine)
+        self.event.set()
+
+    def resume(self, machine):
+        #Makes an idle machine ready again, counting the time it spent idle
+        #as the timer would have seen it.
+        if machine.state != IDLE:
+            return
+        cpu = machine.cpu
+        cpu.cycles += cpu.idle_cycles(None, self.clock() - machine.parked_at)
+        self.push(machine)
+
+    def wake_due(self):
+        while self.woken:
+            self.resume(self.woken.popleft())
+        now = self.clock()
+        while self.sleeping and self.sleeping[0][0] <= now:
+            self.resume(heapq.heappop(self.sleeping)[2])
+        #Machines woken early by a device leave their entry behind, which
+        #run() mustn't wait for.
+        while self.sleeping and self.sleeping[0][2].state != IDLE:
+            heapq.heappop(self.sleeping)
+
+    def park(self, machine):
+        cpu = machine.cpu
+        machine.state = IDLE
+        machine.parked_at = self.clock()
+        #A device may have raised an interrupt after the CPU went idle.
+        if cpu.intc.pending:
+            self.resume(machine)
+            return
+        timeout = cpu.idle_timeout(None)
+        if timeout is not None:
+            self.sequence += 1
+            heapq.heappush(self.sleeping, (machine.parked_at + timeout, self.sequence, machine))
+
+    def retire(self, machine, state):
+        machine.state = state
+        self.active -= 1
+        if self.on_exit is not None:
+            self.on_exit(machine)
+
+    def turn(self, machine):
+        """Step one machine for up to its quota; returns the cycles it ran."""
+        cpu = machine.cpu
+        tenant = machine.tenant
+        quota = machine.quota
+        remaining = tenant.remaining
+        if remaining is not None:
+            if remaining == 0:
+                machine.state = OVER_BUDGET
+                tenant.parked.append(machine)
+                return 0
+            quota = min(quota, remaining)
+
+        before = cpu.cycles
+        idle = False
+        failed = False
+        try:
+            with contextlib.redirect_stdout(machine.console):
+                cpu.step(quota)
+        except Idle:
+            idle = True
+        except SystemExit as e:
+            failed = True
+            machine.exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            failed = True
+            machine.exit_code = 1
+            machine.console.write(f"{type(e).__name__}: {e}\n")
+        used = cpu.cycles - before
+        machine.cycles += used
+        tenant.used += used
+
+        if failed:
+            self.retire(machine, FAILED)
+        elif cpu.halted:
+            self.retire(machine, HALTED)
+        elif idle:
+            self.park(machine)
+        else:
+            self.push(machine)
+        return used
+
+    def run(self, timeout=None):
+        """
+        Run machines until none can make progress by itself, or for at most
+        timeout seconds. Machines waiting for a device or for more budget
+        stay parked for a later run(). Returns the number of cycles run.
+        """
+
+        deadline = None if timeout is None else self.clock() + timeout
+        total = 0
+        while True:
+            self.wake_due()
+            if deadline is not None and self.clock() >= deadline:
+                break
+            if not self.ready:
+                if not self.sleeping:
+                    break
+                wait = self.sleeping[0][0] - self.clock()
+                if deadline is not None:
+                    wait = min(wait, deadline - self.clock())
+                self.event.wait(max(wait, 0))
+                self.event.clear()
+                continue
+            total += self.turn(heapq.heappop(self.ready)[2])
+        return total
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("images", nargs="+", help=".ls8 files or glob patterns")
+    parser.add_argument("--quota", type=int, default=1000,
+                        help="cycles per turn (default: 1000)")
+    parser.add_argument("--policy", choices=[ROUND_ROBIN, PRIORITY], default=ROUND_ROBIN)
+    parser.add_argument("--budget", type=int, default=None,
+                        help="cycle budget for each program")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="stop everything after this many seconds")
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("-o", "--output", default="-",
+                        help="report file (default: stdout)")
+    args = parser.parse_args(argv[1:])
+
+    start = time.perf_counter()
+    finished = {}
+    scheduler = Scheduler(args.quota, args.policy,
+                          on_exit=lambda m: finished.setdefault(m.name, time.perf_counter() - start))
+
+    machines = []
+    for image in expand_images(args.images):
+        cpu = CPU()
+        try:
+            cpu.load(image)
+        except (OSError, ValueError) as e:
+            print(f"Could not load {image}: {e}", file=sys.stderr)
+            return 1
+        #Each program is its own tenant, so --budget applies to each.
+        machines.append(scheduler.add(cpu, name=image, tenant=image))
+        scheduler.set_budget(image, args.budget)
+
+    scheduler.run(args.timeout)
+    elapsed = time.perf_counter() - start
+
+    statuses = {HALTED: "halted", FAILED: "error", OVER_BUDGET: "cycle_limit"}
+    rows = [{
+        "image": m.name,
+        "status": statuses.get(m.state, "timeout"),
+        "exit_code": m.exit_code,
+        "cycles": m.cycles,
+        "wall_time": finished.get(m.name, elapsed),
+        "output": m.console.getvalue(),
+    } for m in machines]
+
+    if args.output == "-":
+        write_report(rows, sys.stdout, args.format)
+    else:
+        with open(args.output, "w", newline="") as f:
+            write_report(rows, f, args.format)
+
+    failed = [r for r in rows if r["status"] != "halted"]
+    print(f"{len(rows)} runs, {len(failed)} not halted", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
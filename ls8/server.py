@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+"""Emulator server: runs programs for clients on a pool of warm workers."""
+
+#Starting a Python interpreter and importing the emulator costs far more
+#than running a short program, so the server keeps worker processes with
+#everything imported, and each request just gets a fresh CPU in one of
+#them. Requests run in parallel across the workers, and any number of
+#clients can be connected at once.
+#
+#Clients talk JSON lines, over a UNIX socket or the server's stdin/stdout:
+#
+#  python server.py --socket /tmp/ls8.sock -j 4
+#  python server.py --stdio
+#
+#A request names its program one of three ways: "path" (a file the server
+#can read), "program" (.ls8 text) or "image" (a base64 binary image). It
+#may also give "id" (echoed in every reply), "input" (keys for the
+#keyboard), "max_cycles" and "timeout" (seconds):
+#
+#  {"id": 1, "path": "examples/keyboard.ls8", "input": "hi", "timeout": 1}
+#
+#Output is streamed back as it is produced, as {"id": ..., "output": text}
+#lines, and the last line for a request carries its final state:
+#
+#  {"id": 1, "status": "timeout", "exit_code": 0, "cycles": 1234,
+#   "wall_time": 1.0, "pc": 15, "fl": 0, "reg": [...], "done": true}
+#
+#status is "halted", "cycle_limit", "timeout" or "error", as for fleet.py.
+
+import io
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import threading
+import contextlib
+import multiprocessing
+
+from cpu import *
+from keyboard import Keyboard
+from output import BufferedOutput
+
+#Cycles run between timeout checks.
+SLICE = 10000
+
+
+class Replies:
+    """Stream for a BufferedOutput that sends each flush as an output reply."""
+
+    def __init__(self, send, request_id):
+        self.send = send
+        self.request_id = request_id
+
+    def write(self, text):
+        if text:
+            self.send({"id": self.request_id, "output": text})
+
+    def flush(self):
+        pass
+
+
+def open_program(request):
+    if "path" in request:
+        return request["path"]
+    if "program" in request:
+        return io.StringIO(request["program"])
+    if "image" in request:
+        return io.BytesIO(base64.b64decode(request["image"]))
+    raise ValueError("request has no path, program or image")
+
+
+def run_request(request, send):
+    """
+    Run one request in a fresh CPU, streaming its output through send, and
+    return the final reply.
+    """
+
+    start = time.perf_counter()
+    request_id = request.get("id")
+    max_cycles = request.get("max_cycles")
+    timeout = request.get("timeout")
+    replies = Replies(send, request_id)
+    cpu = CPU()
+    cpu.output = BufferedOutput(replies)
+    status = "halted"
+    exit_code = 0
+
+    try:
+        #Error messages printed by the CPU are streamed like its output.
+        with contextlib.redirect_stdout(replies):
+            cpu.load(open_program(request))
+            if request.get("input"):
+                Keyboard(cpu).feed(request["input"])
+            while cpu.halted is False:
+                budget = SLICE
+                if max_cycles is not None:
+                    budget = min(budget, max_cycles - cpu.cycles)
+                    if budget <= 0:
+                        status = "cycle_limit"
+                        break
+                cpu.run(budget)
+                if timeout is not None and time.perf_counter() - start > timeout:
+                    if cpu.halted is False:
+                        status = "timeout"
+                    break
+    except SystemExit as e:
+        status = "error"
+        exit_code = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        status = "error"
+        exit_code = 1
+        cpu.output.flush()
+        replies.write(f"{type(e).__name__}: {e}\n")
+
+    return {
+        "id": request_id,
+        "status": status,
+        "exit_code": exit_code,
+        "cycles": cpu.cycles,
+        "wall_time": time.perf_counter() - start,
+        "pc": cpu.pc,
+        "fl": cpu.fl,
+        "reg": cpu.reg.tolist(),
+        "done": True,
+    }
+
+
+def worker(tasks, results):
+    #Runs requests until it gets None. Replies go back tagged with the
+    #server's key for the request.
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        key, request = task
+        send = lambda reply: results.put((key, reply))
+        send(run_request(request, send))
+
+
+class Server:
+    """Pool of worker processes, and the clients waiting on them."""
+
+    def __init__(self, jobs=None):
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.workers = []
+        #Request key -> function taking that request's replies.
+        self.waiting = {}
+        self.next_key = 0
+        self.loop = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        for _ in range(self.jobs):
+            process = multiprocessing.Process(target=worker, args=(self.tasks, self.results), daemon=True)
+            process.start()
+            self.workers.append(process)
+        threading.Thread(target=self.read_results, name="ls8-results", daemon=True).start()
+
+    def stop(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for process in self.workers:
+            process.join(timeout=1)
+
+    def read_results(self):
+        #Hands replies from the workers over to the event loop.
+        while True:
+            key, reply = self.results.get()
+            self.loop.call_soon_threadsafe(self.deliver, key, reply)
+
+    def deliver(self, key, reply):
+        send = self.waiting[key] if not reply.get("done") else self.waiting.pop(key)
+        send(reply)
+
+    def submit(self, request, send):
+        """Queue a request; send is called with each of its replies."""
+        self.next_key += 1
+        self.waiting[self.next_key] = send
+        self.tasks.put((self.next_key, request))
+
+    async def serve(self, reader, write):
+        """
+        Run every request read from reader, passing each reply line to
+        write, until the client is done and all its requests have finished.
+        """
+
+        pending = 0
+        finished = asyncio.Event()
+        finished.set()
+
+        def send(reply):
+            nonlocal pending
+            write(json.dumps(reply) + "\n")
+            if reply.get("done"):
+                pending -= 1
+                if pending == 0:
+                    finished.set()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be a JSON object")
+            except ValueError as e:
+                write(json.dumps({"error": f"bad request: {e}", "done": True}) + "\n")
+                continue
+            pending += 1
+            finished.clear()
+            self.submit(request, send)
+        await finished.wait()
+
+    async def client(self, reader, writer):
+        await self.serve(reader, lambda line: writer.write(line.encode()))
+        await writer.drain()
+        writer.close()
+
+
+async def serve_socket(server, path):
+    unix_server = await asyncio.start_unix_server(server.client, path=path)
+    async with unix_server:
+        await unix_server.serve_forever()
+
+
+async def serve_stdio(server):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    def write(line):
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+    await server.serve(reader, write)
+
+
+async def run_server(args):
+    server = Server(args.jobs)
+    server.start()
+    try:
+        if args.socket:
+            await serve_socket(server, args.socket)
+        else:
+            await serve_stdio(server)
+    finally:
+        server.stop()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--socket", help="listen on this UNIX socket path")
+    mode.add_argument("--stdio", action="store_true",
+                      help="read requests from stdin, reply on stdout")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    args = parser.parse_args(argv[1:])
+
+    try:
+        asyncio.run(run_server(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,148 @@
+"""CPU snapshots: the whole machine state as a compact bytes blob."""
+
+#A snapshot is a fixed-size part followed by variable-length sections:
+#
+#  STATE     magic b"LS8S", format version, PC, FL, ie, IR, MAR, MDR,
+#            halted, cycles
+#  ram       256 bytes
+#  reg       8 bytes
+#  TIMER     mode, period, check_every, cycles_per_second, deadline (-1
+#            before the timer starts), next tick
+#  SECTIONS  lengths of the three sections below
+#  keys      keys queued in the keyboard
+#  symbols   as in an image (see image.py)
+#  debug     as in an image
+#
+#A real-time timer's next tick is stored as the time left until it, so a
+#restored machine ticks on schedule however much later it is restored.
+#Buffered output is flushed before a snapshot is taken, not saved with it.
+#PC takes two bytes, as a HLT in the last byte of memory leaves it at 256;
+#version 1 had one.
+
+import os
+import struct
+from array import array
+
+from image import pack_symbols, unpack_symbols
+from timer import REAL, VIRTUAL
+
+MAGIC = b"LS8S"
+VERSION = 2
+STATE = struct.Struct("<4sBH5B?Q")
+TIMER = struct.Struct("<?dIdqd")
+SECTIONS = struct.Struct("<HHI")
+
+RAM_SIZE = 256
+REG_COUNT = 8
+
+
+def take(cpu):
+    """Return a snapshot of cpu."""
+    cpu.output.flush()
+    timer = cpu.timer
+    if timer.deadline is None:
+        deadline, next_tick = -1, 0
+    elif timer.mode == REAL:
+        deadline, next_tick = timer.deadline, timer.next_tick - timer.clock()
+    else:
+        deadline, next_tick = timer.deadline, timer.next_tick
+    keys = bytes(cpu.keyboard.keys) if cpu.keyboard is not None else b""
+    symbols = pack_symbols(cpu.symbols)
+    debug = bytes(cpu.debug_info)
+
+    return b"".join((
+        STATE.pack(MAGIC, VERSION, cpu.pc, cpu.fl, cpu.ie, cpu.ir, cpu.mar & 0xFF,
+                   (cpu.mdr or 0) & 0xFF, cpu.halted, cpu.cycles),
+        bytes(cpu.ram),
+        cpu.reg.tobytes(),
+        TIMER.pack(timer.mode == VIRTUAL, timer.period, timer.check_every,
+                   timer.cycles_per_second, deadline, next_tick),
+        SECTIONS.pack(len(keys), len(symbols), len(debug)),
+        keys,
+        symbols,
+        debug,
+    ))
+
+
+def apply(cpu, data):
+    """Put cpu in the state saved in the snapshot data."""
+    data = memoryview(data)
+    if len(data) < STATE.size + RAM_SIZE + REG_COUNT + TIMER.size + SECTIONS.size:
+        raise ValueError("LS-8 snapshot is truncated")
+    magic, version, pc, fl, ie, ir, mar, mdr, halted, cycles = STATE.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not an LS-8 snapshot")
+    if version != VERSION:
+        raise ValueError(f"unsupported LS-8 snapshot version {version}")
+    offset = STATE.size
+    ram = data[offset:offset + RAM_SIZE]
+    offset += RAM_SIZE
+    reg = data[offset:offset + REG_COUNT]
+    offset += REG_COUNT
+    virtual, period, check_every, cycles_per_second, deadline, next_tick = TIMER.unpack_from(data, offset)
+    offset += TIMER.size
+    keys_len, sym_len, debug_len = SECTIONS.unpack_from(data, offset)
+    offset += SECTIONS.size
+    end = offset + keys_len + sym_len + debug_len
+    if end > len(data):
+        raise ValueError("LS-8 snapshot is truncated")
+    if end < len(data):
+        raise ValueError("LS-8 snapshot is malformed: trailing data")
+    keys = bytes(data[offset:offset + keys_len])
+    offset += keys_len
+    symbols = unpack_symbols(data[offset:offset + sym_len])
+    offset += sym_len
+    debug = bytes(data[offset:end])
+
+    cpu.ram[:] = ram
+    cpu.reg[:] = array('B', reg)
+    cpu.pc, cpu.fl, cpu.ie, cpu.ir, cpu.mar, cpu.mdr = pc, fl, ie, ir, mar, mdr
+    cpu.halted = halted
+    cpu.cycles = cycles
+    cpu.symbols = symbols
+    cpu.debug_info = debug
+    cpu.spin_state = None
+
+    timer = cpu.timer
+    timer.mode = VIRTUAL if virtual else REAL
+    timer.period = period
+    timer.check_every = check_every
+    timer.cycles_per_second = cycles_per_second
+    if deadline < 0:
+        timer.deadline = timer.next_tick = None
+    elif virtual:
+        timer.deadline, timer.next_tick = deadline, int(next_tick)
+    else:
+        timer.deadline, timer.next_tick = deadline, timer.clock() + next_tick
+
+    if keys or cpu.keyboard is not None:
+        from keyboard import Keyboard
+        keyboard = cpu.keyboard if cpu.keyboard is not None else Keyboard(cpu)
+        keyboard.keys.clear()
+        keyboard.keys.extend(keys)
+
+    #Everything cached about the old memory contents is gone.
+    cpu.decoded = [None] * len(cpu.ram)
+    if cpu.blocks is not None:
+        cpu.blocks.clear()
+    cpu.intc.update()
+
+
+def save(cpu, path):
+    """
+    Write a snapshot of cpu to path. The file is replaced in one step, so a
+    crash never leaves half a snapshot behind.
+    """
+
+    temp = f"{path}.tmp"
+    with open(temp, "wb") as f:
+        f.write(take(cpu))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def load(cpu, path):
+    """Restore cpu from a snapshot file written by save."""
+    with open(path, "rb") as f:
+        apply(cpu, f.read())
@@ -0,0 +1,68 @@
+"""BatchCPU lanes end in the same state as the scalar CPU."""
+
+import os
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from cpu import *
+from output import NullOutput
+
+if numpy is not None:
+    from batch import BatchCPU
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+
+#LDI R0,250 / ADDI R0,10 / LDI R1,3 / ADDI R1,4 / ADD R0,R1 / PRN R0 / HLT
+ADDI_PROGRAM = bytes([
+    LDI, 0, 250,
+    ADDI, 0, 10,
+    LDI, 1, 3,
+    ADDI, 1, 4,
+    ADD, 0, 1,
+    PRN, 0,
+    HLT,
+])
+
+
+def run_scalar(program):
+    cpu = CPU()
+    cpu.output = NullOutput()
+    cpu.ram[:len(program)] = program
+    cpu.run()
+    return cpu
+
+
+@unittest.skipIf(numpy is None, "needs NumPy")
+class BatchTest(unittest.TestCase):
+
+    def check(self, program):
+        cpu = run_scalar(program)
+        batch = BatchCPU(3)
+        batch.load(program)
+        batch.run()
+        for lane in range(3):
+            self.assertFalse(batch.error[lane])
+            self.assertEqual(batch.reg[lane].tolist(), cpu.reg.tolist())
+            self.assertEqual(int(batch.fl[lane]), cpu.fl)
+            self.assertEqual(int(batch.pc[lane]), cpu.pc)
+
+    def test_addi(self):
+        self.check(ADDI_PROGRAM)
+        batch = BatchCPU(1)
+        batch.load(ADDI_PROGRAM)
+        batch.run()
+        self.assertEqual(batch.output[0], ["11\n"])
+
+    def test_examples(self):
+        for name in ("mult.ls8", "call.ls8", "sctest.ls8", "stack.ls8"):
+            cpu = CPU()
+            cpu.load(os.path.join(EXAMPLES, name))
+            self.check(bytes(cpu.ram))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+"""Programs compiled ahead of time run like interpreted ones."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import compile
+from test_cycles import CYCLES, EXAMPLES, make_cpu
+
+
+class CompileTest(unittest.TestCase):
+
+    def test_cycles(self):
+        for name, cycles in CYCLES.items():
+            module = compile.compile_program(os.path.join(EXAMPLES, name))
+            with mock.patch("sys.stdout"):
+                cpu = compile.run_compiled(module)
+            self.assertEqual(cpu.cycles, cycles, name)
+            self.assertEqual(cpu.reg.tolist(), self.interpreted(name).reg.tolist(), name)
+
+    def interpreted(self, name):
+        cpu = make_cpu(name)
+        cpu.run()
+        return cpu
+
+    def test_key_covers_cpu(self):
+        #Editing cpu.py (say, the decode record layout) changes the key.
+        with tempfile.TemporaryDirectory() as here:
+            for name in compile.TRANSLATOR:
+                shutil.copy(os.path.join(compile.HERE, name), here)
+            with mock.patch.object(compile, "HERE", here):
+                before = compile.image_key(b"\x01")
+                with open(os.path.join(here, "cpu.py"), "a") as f:
+                    f.write("\n")
+                self.assertNotEqual(compile.image_key(b"\x01"), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""CPU behaviour outside the instruction set itself."""
+
+import io
+import os
+import sys
+import subprocess
+import unittest
+from contextlib import redirect_stdout
+
+from cpu import CPU, LDI
+from output import NullOutput
+from profiler import Profiler
+from tracer import Tracer
+
+
+def off_end_cpu():
+    #An LDI in the last three bytes leaves the PC at 256.
+    cpu = CPU()
+    cpu.output = NullOutput()
+    cpu.ram[253:256] = bytes([LDI, 0, 5])
+    cpu.pc = 253
+    return cpu
+
+
+class OffEndTest(unittest.TestCase):
+
+    def check(self, run):
+        cpu = off_end_cpu()
+        out = io.StringIO()
+        with redirect_stdout(out), self.assertRaises(SystemExit) as raised:
+            run(cpu)
+        self.assertEqual(raised.exception.code, 1)
+        self.assertIn("memory address: 256", out.getvalue())
+        self.assertIn("Could not find instruction", out.getvalue())
+        self.assertEqual(cpu.reg[0], 5)
+
+    def test_run(self):
+        self.check(lambda cpu: cpu.run())
+
+    def test_run_blocks(self):
+        self.check(lambda cpu: cpu.run_blocks())
+
+    def test_profiler(self):
+        def run(cpu):
+            cpu.profiler = Profiler()
+            cpu.run()
+        self.check(run)
+
+    def test_tracer(self):
+        def run(cpu):
+            cpu.tracer = Tracer(capacity=4)
+            cpu.run()
+        self.check(run)
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_asyncio_not_imported(self):
+        #Only run_async needs it, and it is slow to import.
+        code = "import sys, cpu; print('asyncio' in sys.modules)"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        self.assertEqual(out.stdout.strip(), "False")
+
+
+if __name__ == "__main__":
+    unittest.main()
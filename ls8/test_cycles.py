@@ -0,0 +1,143 @@
+"""Every engine counts the same cycles for the same program, idle or not."""
+
+import os
+import unittest
+
+from cpu import CPU, LDI, JMP, JEQ, CMP, ST, HLT
+from interrupts import VECTOR_TABLE
+from output import NullOutput
+from timer import Timer, VIRTUAL
+from tracer import Tracer
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+
+#Example -> instructions it runs to HLT.
+CYCLES = {"mult.ls8": 5, "sctest.ls8": 24, "call.ls8": 22}
+
+
+def make_cpu(name):
+    cpu = CPU()
+    cpu.output = NullOutput()
+    cpu.load(os.path.join(EXAMPLES, name))
+    return cpu
+
+
+class CycleTest(unittest.TestCase):
+
+    def test_run(self):
+        for name, cycles in CYCLES.items():
+            cpu = make_cpu(name)
+            self.assertEqual(cpu.run(), cycles, name)
+            self.assertEqual(cpu.cycles, cycles, name)
+
+    def test_run_blocks(self):
+        for name, cycles in CYCLES.items():
+            cpu = make_cpu(name)
+            self.assertEqual(cpu.run_blocks(), cycles, name)
+            self.assertEqual(cpu.cycles, cycles, name)
+
+    def test_tracer_keeps_every_record(self):
+        for name, cycles in CYCLES.items():
+            cpu = make_cpu(name)
+            cpu.tracer = tracer = Tracer(capacity=64)
+            self.assertEqual(cpu.run(), cycles, name)
+            records = tracer.records()
+            self.assertEqual(len(records), cycles, name)
+            self.assertEqual([r[0] for r in records], list(range(1, cycles + 1)))
+
+
+#Each program enables the timer interrupt and loops until it arrives. The
+#handler at HANDLER halts.
+HANDLER = 0x40
+
+SELF_JUMP = [LDI, 5, 1, LDI, 1, 6, JMP, 1]
+
+#CMP R0,R1 / JEQ R2, always equal.
+CMP_SPIN = [LDI, 5, 1, LDI, 2, 6, CMP, 0, 1, JEQ, 2]
+
+#ST R3,R0 / JMP R2: the loop writes memory each time round.
+STORE_LOOP = [LDI, 5, 1, LDI, 2, 9, LDI, 3, 0x80, ST, 3, 0, JMP, 2]
+
+
+class Counting(CPU):
+    """A CPU that counts its idle fast-forwards."""
+
+    def __init__(self):
+        super().__init__()
+        self.idled = 0
+
+    def fast_forward(self, budget):
+        self.idled += 1
+        return super().fast_forward(budget)
+
+
+class Plain(Counting):
+    """A CPU that never notices it is idle."""
+
+    def check_spin(self, target, pc):
+        pass
+
+
+def timer_cpu(program, cls=Counting):
+    #One tick every 1000 cycles, in virtual time.
+    cpu = cls()
+    cpu.output = NullOutput()
+    cpu.timer = Timer(VIRTUAL, period=1, cycles_per_second=1000)
+    cpu.ram[:len(program)] = bytes(program)
+    cpu.ram[VECTOR_TABLE] = HANDLER
+    cpu.ram[HANDLER] = HLT
+    return cpu
+
+
+class IdleTest(unittest.TestCase):
+
+    def check_skips_to_tick(self, program):
+        cpu = timer_cpu(program)
+        plain = timer_cpu(program, Plain)
+        self.assertEqual(cpu.run(), plain.run())
+        #The handler's HLT runs just after the tick at cycle 1000.
+        self.assertEqual(cpu.cycles, 1001)
+        self.assertEqual(cpu.pc, HANDLER + 1)
+        self.assertEqual((cpu.pc, bytes(cpu.ram), cpu.reg),
+                         (plain.pc, bytes(plain.ram), plain.reg))
+        self.assertEqual(cpu.idled, 1)
+        self.assertEqual(plain.idled, 0)
+
+    def test_self_jump(self):
+        self.check_skips_to_tick(SELF_JUMP)
+
+    def test_cmp_spin(self):
+        self.check_skips_to_tick(CMP_SPIN)
+
+    def test_cmp_spin_unfused(self):
+        cpu = timer_cpu(CMP_SPIN)
+        cpu.unfuse()
+        self.assertEqual(cpu.run(), 1001)
+        self.assertEqual(cpu.idled, 1)
+
+    def test_store_loop_not_idle(self):
+        cpu = timer_cpu(STORE_LOOP)
+        plain = timer_cpu(STORE_LOOP, Plain)
+        self.assertEqual(cpu.run(), plain.run())
+        self.assertEqual(cpu.idled, 0)
+        self.assertEqual(cpu.pc, HANDLER + 1)
+
+    def test_budget(self):
+        #A fast-forward stops at the budget, and the run picks up from there.
+        cpu = timer_cpu(SELF_JUMP)
+        self.assertEqual(cpu.run(500), 500)
+        self.assertFalse(cpu.halted)
+        self.assertEqual(cpu.run(), 501)
+        self.assertEqual(cpu.cycles, 1001)
+
+    def test_masked_timer_not_idle(self):
+        #With IM clear nothing can wake the loop, so it is left to spin.
+        program = list(SELF_JUMP)
+        program[2] = 0
+        cpu = timer_cpu(program)
+        self.assertEqual(cpu.run(2000), 2000)
+        self.assertEqual(cpu.idled, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
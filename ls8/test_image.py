@@ -0,0 +1,66 @@
+"""Loading binary images from paths and file objects."""
+
+import io
+import os
+import tempfile
+import unittest
+
+from cpu import CPU
+from image import write_image, read_image
+
+CODE = bytes([0b10000010, 0, 8, 0b01000111, 0, 0b00000001])
+
+
+def image_bytes():
+    f = io.BytesIO()
+    write_image(f, CODE, symbols={"START": 0}, debug=b'{"lines": []}')
+    return f.getvalue()
+
+
+class ImageTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".ls8b")
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def write(self, data):
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def test_round_trip(self):
+        self.write(image_bytes())
+        for source in (self.path, io.BytesIO(image_bytes())):
+            ram = bytearray(256)
+            loaded = read_image(source, ram)
+            self.assertEqual(bytes(ram[:len(CODE)]), CODE)
+            self.assertEqual(len(ram), 256)
+            self.assertEqual(loaded.symbols, {"START": 0})
+
+    def test_truncated(self):
+        data = image_bytes()
+        for size in (4, 12, 14, len(data) - 1):
+            self.write(data[:size])
+            for source in (self.path, io.BytesIO(data[:size])):
+                ram = bytearray(256)
+                with self.assertRaises(ValueError):
+                    read_image(source, ram)
+                self.assertEqual(len(ram), 256)
+
+    def test_load_sniffs_format(self):
+        #Binary file objects may hold either format.
+        text = b"".join(b"%s # byte\n" % format(byte, "08b").encode() for byte in CODE)
+        for data in (image_bytes(), text):
+            self.write(data)
+            with open(self.path, "rb") as f:
+                sources = (self.path, io.BytesIO(data), f)
+                for source in sources:
+                    cpu = CPU()
+                    cpu.load(source)
+                    self.assertEqual(bytes(cpu.ram[:len(CODE)]), CODE)
+
+
+if __name__ == "__main__":
+    unittest.main()
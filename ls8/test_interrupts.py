@@ -0,0 +1,47 @@
+"""Entering and leaving interrupt handlers."""
+
+import unittest
+from array import array
+
+from cpu import CPU
+from interrupts import IM, IS, SP, FRAME_SIZE, VECTOR_TABLE
+
+
+class InterruptTest(unittest.TestCase):
+
+    def round_trip(self, sp):
+        cpu = CPU()
+        cpu.ram[VECTOR_TABLE + 1] = 0x40
+        cpu.reg[0:7] = array('B', range(10, 17))
+        cpu.reg[SP] = sp
+        cpu.reg[IM] = 0b10
+        cpu.pc = 0x23
+        cpu.fl = 0b100
+        cpu.ie = 1
+        cpu.intc.request(1)
+
+        cpu.intc.dispatch()
+        self.assertEqual(len(cpu.ram), 256)
+        #(Frames near the top of memory overwrite the vector itself.)
+        self.assertEqual(cpu.pc, cpu.ram[VECTOR_TABLE + 1])
+        self.assertEqual(cpu.reg[SP], (sp - FRAME_SIZE) & 0xFF)
+
+        cpu.reg[0:5] = array('B', bytes(5))
+        cpu.fl = 0
+        cpu.intc.iret()
+        self.assertEqual(len(cpu.ram), 256)
+        self.assertEqual(cpu.reg[0:5].tolist(), list(range(10, 15)))
+        self.assertEqual(cpu.pc, 0x23)
+        self.assertEqual(cpu.fl, 0b100)
+        self.assertEqual(cpu.reg[SP], sp)
+
+    def test_frame(self):
+        self.round_trip(0xF4)
+
+    def test_frame_wraps(self):
+        for sp in (0, 1, 8, 9, 248, 255):
+            self.round_trip(sp)
+
+
+if __name__ == "__main__":
+    unittest.main()
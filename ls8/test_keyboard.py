@@ -0,0 +1,67 @@
+"""Keyboard input, and the output it produces while the CPU waits for more."""
+
+import io
+import os
+import asyncio
+import unittest
+import threading
+
+from cpu import CPU
+from keyboard import Keyboard
+from output import BufferedOutput
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+
+
+class Stop(Exception):
+    pass
+
+
+class Probe(threading.Event):
+    #Wakeup event that records the output seen when the CPU goes to sleep,
+    #and stops the run instead of sleeping.
+
+    def __init__(self, out):
+        super().__init__()
+        self.out = out
+        self.seen = []
+
+    def wait(self, timeout=None):
+        self.seen.append(self.out.getvalue())
+        raise Stop
+
+
+class KeyboardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.out = io.StringIO()
+        self.cpu = CPU()
+        self.cpu.output = BufferedOutput(self.out)
+        self.cpu.load(os.path.join(EXAMPLES, "keyboard.ls8"))
+        self.keyboard = Keyboard(self.cpu)
+
+    def test_echo_is_flushed_before_sleeping(self):
+        probe = self.cpu.wakeup = Probe(self.out)
+        self.keyboard.feed("cd")
+        with self.assertRaises(Stop):
+            self.cpu.run()
+        self.assertEqual(probe.seen, ["cd"])
+
+    def test_echo_is_drained_before_waiting_async(self):
+        self.keyboard.feed("cd")
+
+        async def main():
+            task = asyncio.ensure_future(self.cpu.run_async())
+            for _ in range(100):
+                await asyncio.sleep(0)
+                if self.out.getvalue() == "cd":
+                    break
+            seen = self.out.getvalue()
+            task.cancel()
+            return seen
+
+        self.assertEqual(asyncio.run(main()), "cd")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+"""Scheduling order, parking idle machines and tenant budgets."""
+
+import os
+import time
+import threading
+import unittest
+
+from cpu import CPU, LDI, JMP, JEQ, CMP, HLT, IS_KEYBOARD
+from interrupts import VECTOR_TABLE
+from output import NullOutput
+from scheduler import Scheduler, ROUND_ROBIN, PRIORITY, READY, IDLE, HALTED, OVER_BUDGET
+from timer import Timer
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+
+#Interrupt handlers, both halting.
+TIMER_HANDLER = 0x40
+KEYBOARD_HANDLER = 0x50
+
+
+def idle_program(mask):
+    #Sets IM to mask, then jumps to itself until an interrupt.
+    return [LDI, 5, mask, LDI, 1, 6, JMP, 1]
+
+#CMP R0,R1 / JEQ R2 with interrupts masked: spins forever two cycles a
+#record, as the pair is fused.
+SPIN = [LDI, 2, 3, CMP, 0, 1, JEQ, 2]
+
+
+def make_cpu(program=None, example=None, period=1.0, cls=CPU):
+    cpu = cls()
+    cpu.output = NullOutput()
+    cpu.timer = Timer(period=period, check_every=64)
+    if example is not None:
+        cpu.load(os.path.join(EXAMPLES, example))
+    else:
+        cpu.ram[:len(program)] = bytes(program)
+    cpu.ram[VECTOR_TABLE] = TIMER_HANDLER
+    cpu.ram[VECTOR_TABLE + 1] = KEYBOARD_HANDLER
+    cpu.ram[TIMER_HANDLER] = HLT
+    cpu.ram[KEYBOARD_HANDLER] = HLT
+    cpu.wakeups |= IS_KEYBOARD
+    return cpu
+
+
+def press(cpu):
+    #What a keyboard does when a key arrives.
+    cpu.intc.request(1)
+    cpu.wakeup.set()
+
+
+class Logging(Scheduler):
+    """A Scheduler that records whose turn each one was."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log = []
+
+    def turn(self, machine):
+        self.log.append(machine.name)
+        return super().turn(machine)
+
+
+class OrderTest(unittest.TestCase):
+
+    def run_three(self, policy):
+        scheduler = Logging(quota=5, policy=policy)
+        machines = [scheduler.add(make_cpu(example="sctest.ls8"), name, priority=priority)
+                    for name, priority in (("a", 0), ("b", 1), ("c", 2))]
+        scheduler.run()
+        for machine in machines:
+            self.assertEqual(machine.state, HALTED)
+        return scheduler.log
+
+    def test_round_robin(self):
+        log = self.run_three(ROUND_ROBIN)
+        turns = len(log) // 3
+        self.assertEqual(log, ["a", "b", "c"] * turns)
+
+    def test_priority(self):
+        log = self.run_three(PRIORITY)
+        turns = len(log) // 3
+        self.assertEqual(log, ["c"] * turns + ["b"] * turns + ["a"] * turns)
+
+
+class ParkTest(unittest.TestCase):
+
+    def test_parked_until_device(self):
+        scheduler = Scheduler()
+        cpu = make_cpu(idle_program(IS_KEYBOARD))
+        machine = scheduler.add(cpu)
+        scheduler.run()
+        #Nothing but the keyboard can wake it, so run() leaves it parked.
+        self.assertEqual(machine.state, IDLE)
+        self.assertEqual(scheduler.sleeping, [])
+        press(cpu)
+        scheduler.run()
+        self.assertEqual(machine.state, HALTED)
+        self.assertEqual(cpu.pc, KEYBOARD_HANDLER + 1)
+
+    def test_interrupt_pending_at_park(self):
+        #A key arriving between going idle and being parked isn't lost.
+        class Racing(CPU):
+            def fast_forward(self, budget):
+                self.intc.request(1)
+                return super().fast_forward(budget)
+
+        scheduler = Scheduler()
+        cpu = make_cpu(idle_program(IS_KEYBOARD), cls=Racing)
+        machine = scheduler.add(cpu)
+        scheduler.run()
+        self.assertEqual(machine.state, HALTED)
+        self.assertEqual(cpu.pc, KEYBOARD_HANDLER + 1)
+
+    def test_device_wakes_from_thread(self):
+        #The timer is unmasked but a long way off; run() waits for it, and a
+        #key from another thread cuts the wait short.
+        scheduler = Scheduler()
+        cpu = make_cpu(idle_program(1 | IS_KEYBOARD), period=30)
+        machine = scheduler.add(cpu)
+        scheduler.run(timeout=0.01)
+        self.assertEqual(machine.state, IDLE)
+        self.assertEqual(len(scheduler.sleeping), 1)
+
+        timer = threading.Timer(0.05, press, (cpu,))
+        start = time.monotonic()
+        timer.start()
+        try:
+            scheduler.run(timeout=10)
+        finally:
+            timer.cancel()
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(machine.state, HALTED)
+        self.assertEqual(cpu.pc, KEYBOARD_HANDLER + 1)
+
+    def test_sleeping_until_tick(self):
+        scheduler = Scheduler()
+        cpu = make_cpu(idle_program(1), period=0.05)
+        machine = scheduler.add(cpu)
+        start = time.monotonic()
+        scheduler.run(timeout=10)
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+        self.assertEqual(machine.state, HALTED)
+        self.assertEqual(cpu.pc, TIMER_HANDLER + 1)
+        #Time spent parked counts on the CPU's clock, not as work done.
+        self.assertLess(machine.cycles, cpu.cycles)
+
+
+class BudgetTest(unittest.TestCase):
+
+    def test_budget_parks_and_resumes(self):
+        scheduler = Scheduler(quota=100)
+        machines = [scheduler.add(make_cpu(SPIN), name, tenant="t") for name in "ab"]
+        scheduler.set_budget("t", 1001)
+        total = scheduler.run()
+        tenant = scheduler.tenant("t")
+        #Fused records run two instructions, so a turn can end one over.
+        self.assertEqual(total, tenant.used)
+        self.assertIn(tenant.used, (1001, 1002))
+        for machine in machines:
+            self.assertEqual(machine.state, OVER_BUDGET)
+        self.assertEqual(len(tenant.parked), 2)
+
+        scheduler.set_budget("t", 2001)
+        for machine in machines:
+            self.assertEqual(machine.state, READY)
+        scheduler.run()
+        self.assertIn(tenant.used, (2001, 2002))
+        self.assertEqual(sum(m.cycles for m in machines), tenant.used)
+
+    def test_other_tenants_unaffected(self):
+        scheduler = Scheduler(quota=100)
+        spinner = scheduler.add(make_cpu(SPIN), "spin", tenant="t")
+        other = scheduler.add(make_cpu(example="sctest.ls8"), "other", tenant="u")
+        scheduler.set_budget("t", 500)
+        scheduler.run()
+        self.assertEqual(spinner.state, OVER_BUDGET)
+        self.assertEqual(other.state, HALTED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+"""Snapshots round trip the machine and reject damaged data."""
+
+import os
+import unittest
+
+from cpu import CPU, HLT
+from output import NullOutput
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        cpu = CPU()
+        cpu.output = NullOutput()
+        cpu.load(os.path.join(EXAMPLES, "call.ls8"))
+        cpu.run(10)
+        child = cpu.fork()
+        child.output = NullOutput()
+        self.assertEqual(child.run(), cpu.run())
+        self.assertTrue(child.halted)
+        self.assertEqual((child.pc, child.cycles, bytes(child.ram), child.reg),
+                         (cpu.pc, cpu.cycles, bytes(cpu.ram), cpu.reg))
+
+    def test_halted_at_end_of_memory(self):
+        cpu = CPU()
+        cpu.output = NullOutput()
+        cpu.ram[0xFF] = HLT
+        cpu.pc = 0xFF
+        cpu.run()
+        self.assertEqual(cpu.pc, 256)
+        child = cpu.fork()
+        self.assertEqual(child.pc, 256)
+        self.assertTrue(child.halted)
+
+    def test_truncated(self):
+        data = CPU().snapshot()
+        for size in (10, len(data) - 1):
+            with self.assertRaisesRegex(ValueError, "truncated"):
+                CPU().restore(data[:size])
+
+    def test_trailing_data(self):
+        with self.assertRaisesRegex(ValueError, "trailing data"):
+            CPU().restore(CPU().snapshot() + b"\0")
+
+
+if __name__ == "__main__":
+    unittest.main()
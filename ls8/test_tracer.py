@@ -0,0 +1,53 @@
+"""Tracer ring buffer and trace files."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cpu import CPU
+from output import NullOutput
+from tracer import Tracer, read_trace_file
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+
+
+def make_cpu(name):
+    cpu = CPU()
+    cpu.output = NullOutput()
+    cpu.load(os.path.join(EXAMPLES, name))
+    return cpu
+
+
+class TracerTest(unittest.TestCase):
+
+    def test_sequence_passes_32_bits(self):
+        cpu = make_cpu("mult.ls8")
+        cpu.tracer = tracer = Tracer(capacity=4)
+        tracer.count = 2**32 - 2
+        self.assertEqual(cpu.run(), 5)
+        self.assertEqual([r[0] for r in tracer.records()],
+                         [2**32, 2**32 + 1, 2**32 + 2, 2**32 + 3])
+
+    def test_ring_keeps_last_records(self):
+        cpu = make_cpu("call.ls8")
+        cpu.tracer = tracer = Tracer(capacity=8)
+        cycles = cpu.run()
+        self.assertEqual([r[0] for r in tracer.records()], list(range(cycles - 7, cycles + 1)))
+
+    def test_trace_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "mult.trace")
+            cpu = make_cpu("mult.ls8")
+            cpu.tracer = tracer = Tracer(capacity=16, path=path)
+            cpu.run()
+            records = tracer.records()
+            tracer.close()
+            self.assertEqual(read_trace_file(path), records)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Timer device for the LS-8: raises interrupt 0 once per second."""
+
+#The CPU doesn't ask the timer anything on a normal instruction. It only
+#compares its cycle count with the timer's deadline, and calls poll() once
+#that is reached.
+#
+#* In real-time mode the deadline is every check_every cycles, and poll()
+#  looks at the clock to see whether a period has passed.
+#* In virtual-time mode the clock is the cycle count itself, at
+#  cycles_per_second, so the deadline is exactly the next tick and runs are
+#  deterministic.
+
+import time
+
+REAL = "real"
+VIRTUAL = "virtual"
+
+
+class Timer:
+    """Periodic timer driven by the CPU's cycle count."""
+
+    __slots__ = ('mode', 'period', 'check_every', 'cycles_per_second', 'clock',
+                 'deadline', 'next_tick')
+
+    def __init__(self, mode=REAL, period=1.0, check_every=1024,
+                 cycles_per_second=1000000, clock=time.monotonic):
+        if mode not in (REAL, VIRTUAL):
+            raise ValueError(f"unknown timer mode: {mode}")
+        self.mode = mode
+        self.period = period
+        self.check_every = check_every
+        self.cycles_per_second = cycles_per_second
+        self.clock = clock
+        #Cycle count at which the CPU should call poll() next. None until
+        #the timer is started by the first run.
+        self.deadline = None
+        #When the next tick is due: a clock() time in real-time mode, a
+        #cycle count in virtual-time mode.
+        self.next_tick = None
+
+    @property
+    def period_cycles(self):
+        return max(1, round(self.period * self.cycles_per_second))
+
+    def reset(self, cycles):
+        """Start counting a period from now."""
+        if self.mode == REAL:
+            self.next_tick = self.clock() + self.period
+            self.deadline = cycles + self.check_every
+        else:
+            self.next_tick = cycles + self.period_cycles
+            self.deadline = self.next_tick
+
+    def poll(self, cycles):
+        """Called once cycles reaches the deadline. Returns True on a tick."""
+        if self.mode == REAL:
+            now = self.clock()
+            ticked = now >= self.next_tick
+            if ticked:
+                self.next_tick = now + self.period
+            self.deadline = cycles + self.check_every
+        else:
+            ticked = cycles >= self.next_tick
+            while self.next_tick <= cycles:
+                self.next_tick += self.period_cycles
+            self.deadline = self.next_tick
+        return ticked
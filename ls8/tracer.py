@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+"""Binary execution tracer for the LS-8 CPU."""
+
+#Attaching a Tracer (cpu.tracer = Tracer()) makes CPU.run hand over to the
+#tracer's copy of the run loop, which stores one fixed-size record per
+#instruction in a preallocated ring buffer instead of printing anything.
+#The buffer keeps the last capacity instructions, in memory or in a
+#memory-mapped file that survives the process for post-mortems. The records
+#are only turned into CPU.trace's "TRACE:" text when asked, by format_trace
+#or by running this file on a trace file:
+#
+#  python tracer.py crash.trace
+#
+#Each record is the state before the instruction ran: a sequence number
+#(1 for the first instruction traced, 0 for an unused slot), PC, FL, ie,
+#the three bytes at PC and R0-R7.
+
+import sys
+import mmap
+import struct
+
+from interrupts import Idle
+
+RECORD = struct.Struct("<Q6B8B")
+
+#Trace file header: magic, format version, capacity in records. Version 1
+#had 32-bit sequence numbers.
+FILE_MAGIC = b"LS8T"
+FILE_VERSION = 2
+FILE_HEADER = struct.Struct("<4sII")
+
+
+class Tracer:
+    """Ring buffer of the last capacity instructions run by a CPU."""
+
+    def __init__(self, capacity=65536, path=None):
+        self.capacity = capacity
+        self.count = 0
+        self.path = path
+        size = capacity * RECORD.size
+        if path is None:
+            self.file = None
+            self.buffer = bytearray(size)
+            self.offset = 0
+        else:
+            self.file = open(path, "w+b")
+            self.file.truncate(FILE_HEADER.size + size)
+            self.buffer = mmap.mmap(self.file.fileno(), 0)
+            self.buffer[:FILE_HEADER.size] = FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, capacity)
+            self.offset = FILE_HEADER.size
+
+    def run(self, cpu, max_cycles=None):
+        """CPU.run with tracing. Returns the number of instructions executed."""
+        if cpu.fuse:
+            cpu.unfuse()
+        decoded = cpu.decoded
+        intc = cpu.intc
+        timer = cpu.timer
+        ram = cpu.ram
+        reg = cpu.reg
+        if timer.deadline is None:
+            timer.reset(cpu.cycles)
+        base = cpu.cycles
+        cycles = 0
+        limit = -1 if max_cycles is None else max_cycles
+        next_timer = timer.deadline - base
+        pack_into = RECORD.pack_into
+        buffer = self.buffer
+        capacity = self.capacity
+        offset = self.offset
+        count = self.count
+        try:
+            while True:
+                try:
+                    while cpu.halted is False and cycles != limit:
+
+                        if cycles >= next_timer:
+                            cpu.cycles = base + cycles
+                            cpu.check_for_timer_int()
+                            next_timer = timer.deadline - base
+                        if intc.pending:
+                            intc.dispatch()
+
+                        pc = cpu.pc
+                        record = decoded[pc] or cpu.decode(pc)
+                        handler, operand_a, operand_b, size, sets_pc, steps = record
+                        cpu.ir = ram[pc]
+                        count += 1
+                        pack_into(buffer, offset + (count - 1) % capacity * RECORD.size,
+                                  count, pc, cpu.fl, cpu.ie, ram[pc],
+                                  ram[(pc + 1) & 0xFF], ram[(pc + 2) & 0xFF], *reg)
+                        cycles += steps
+                        handler(operand_a, operand_b)
+                        if not sets_pc:
+                            cpu.pc += size
+                    break
+                except Idle:
+                    pass
+                except IndexError:
+                    if cpu.pc < len(ram):
+                        raise
+                    cpu.ran_off_end()
+                cpu.cycles = base + cycles
+                cycles += cpu.fast_forward(None if limit < 0 else limit - cycles)
+        finally:
+            cpu.cycles = base + cycles
+            self.count = count
+            cpu.output.flush()
+        return cycles
+
+    def records(self):
+        """The records currently held, oldest first."""
+        return read_records(self.buffer, self.offset, self.capacity)
+
+    def close(self):
+        if self.file is not None:
+            self.buffer.flush()
+            self.buffer.close()
+            self.file.close()
+            self.file = None
+
+
+def read_records(buffer, offset, capacity):
+    records = [RECORD.unpack_from(buffer, offset + i * RECORD.size) for i in range(capacity)]
+    return sorted((r for r in records if r[0] != 0), key=lambda r: r[0])
+
+
+def read_trace_file(path):
+    """The records in a trace file written by a Tracer, oldest first."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, capacity = FILE_HEADER.unpack_from(data)
+    if magic != FILE_MAGIC:
+        raise ValueError(f"{path} is not an LS-8 trace file")
+    if version != FILE_VERSION:
+        raise ValueError(f"{path}: unsupported trace file version {version}")
+    return read_records(data, FILE_HEADER.size, capacity)
+
+
+def format_record(pc, fl, ie, ir, byte_a, byte_b, reg):
+    """One line of CPU.trace output."""
+    line = "TRACE: %02X %02X %02X | %02X %02X %02X |" % (pc, fl, ie, ir, byte_a, byte_b)
+    return line + "".join(" %02X" % r for r in reg)
+
+
+def format_trace(records):
+    """Turn records into CPU.trace lines."""
+    return "\n".join(format_record(*r[1:7], r[7:]) for r in records)
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("usage: tracer.py tracefile", file=sys.stderr)
+        return 1
+    records = read_trace_file(argv[1])
+    if records:
+        print(format_trace(records))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))